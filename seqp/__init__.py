@@ -3,10 +3,13 @@ import os
 from . import gen_lib as lib
 from . import seqp_logs
 from . import rbn
+from . import rbn_store
 from . import wspr
 from . import pskreporter
 from . import dxcluster 
+from . import grid_consensus
 from . import data
+from . import loader
 from . import locator
 from . import maps
 from . import geopack
@@ -1,8 +1,12 @@
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
+import tqdm
 
-def order_and_sort(df):
-
-    # Create a data frame with columns in the desired order.
+def spot_keys():
+    """
+    Columns of the unified spot table, in the desired order.
+    """
     # Desired Keys
     dkeys   = []
     dkeys.append('datetime')
@@ -30,25 +34,190 @@ def order_and_sort(df):
     dkeys.append('source')
     dkeys.append('single_op')
     dkeys.append('log_file')
+    return dkeys
+
+def compact_schema():
+    """
+    Compact dtypes for the unified spot table, used by compact_dtypes().
+    'report' marks signal report columns, which become int16 when every
+    value is present and the nullable Int16 otherwise.
+    """
+    schema  = OrderedDict()
+    schema['mode']          = 'category'
+    for key in [0,1]:
+        schema['call_{!s}'.format(key)]     = 'category'
+        schema['srpt_{!s}'.format(key)]     = 'report'
+        schema['grid_{!s}'.format(key)]     = 'category'
+        schema['lat_{!s}'.format(key)]      = 'float32'
+        schema['lon_{!s}'.format(key)]      = 'float32'
+        schema['grid_src_{!s}'.format(key)] = 'category'
+        schema['pfx_{!s}'.format(key)]      = 'category'
+        schema['ctry_{!s}'.format(key)]     = 'category'
+    schema['source']        = 'category'
+    schema['single_op']     = 'boolean'
+    schema['log_file']      = 'category'
+    return schema
+
+def compact_dtypes(df):
+    """
+    Convert a unified spot table to the compact_schema() dtypes.
+    Strings become categoricals, coordinates float32, and signal reports
+    16-bit integers. Columns not in the schema are left alone.
+    """
+    df  = df.copy()
+    for key,dtype in compact_schema().items():
+        if key not in df.columns:
+            continue
+
+        if dtype == 'report':
+            vals    = pd.to_numeric(df[key],errors='coerce').round()
+            if vals.notnull().all():
+                df[key] = vals.astype(np.int16)
+            else:
+                df[key] = vals.astype('Int16')
+        elif dtype == 'boolean':
+            df[key] = df[key].astype('boolean')
+        else:
+            df[key] = df[key].astype(dtype)
+    return df
+
+def memory_report(df,df_compact=None):
+    """
+    Print and return the bytes used by each column of df, before and after
+    conversion with compact_dtypes().
+    """
+    if df_compact is None:
+        df_compact  = compact_dtypes(df)
+
+    rpt = pd.DataFrame({'before':df.memory_usage(deep=True,index=False),
+                        'after':df_compact.memory_usage(deep=True,index=False)})
+    rpt.loc['total']    = rpt.sum()
+    rpt['ratio']        = rpt['after']/rpt['before']
+    print(rpt)
+    return rpt
 
+def order_and_sort(df,compact=False):
+
+    # Create a data frame with columns in the desired order.
     keys = []
-    for dk in dkeys:
+    for dk in spot_keys():
         if dk in df.columns:
             keys.append(dk)
     df  = df[keys]
 
     df.sort_values('datetime',inplace=True)
     df.index    = list(range(len(df)))
+
+    if compact:
+        df  = compact_dtypes(df)
     return df
 
-def combine_spots(spot_dfs):
+def merge_sorted_runs(runs):
+    """
+    K-way merge of already sorted 1-D arrays.
+
+    Returns the permutation that sorts np.concatenate(runs). Runs are
+    merged pairwise in log k rounds, each doing an np.searchsorted of
+    every element into the other run of its pair, so the cost is
+    O(n log n) overall. Ties keep their run order (the merge is stable).
+    """
+    offsets = np.cumsum([0] + [len(x) for x in runs])
+    merged  = [(np.asarray(run),np.arange(offsets[inx],offsets[inx+1])) for inx,run in enumerate(runs)]
+    if len(merged) == 0:
+        return np.array([],dtype=np.int64)
+
+    while len(merged) > 1:
+        nxt = []
+        for inx in range(0,len(merged)-1,2):
+            (a_val,a_inx), (b_val,b_inx) = merged[inx], merged[inx+1]
+
+            # Final position of each element in the merged pair.
+            a_pos   = np.arange(len(a_val)) + np.searchsorted(b_val,a_val,side='left')
+            b_pos   = np.arange(len(b_val)) + np.searchsorted(a_val,b_val,side='right')
+
+            val         = np.empty(len(a_val)+len(b_val),dtype=a_val.dtype)
+            val[a_pos]  = a_val
+            val[b_pos]  = b_val
+            order       = np.empty(len(val),dtype=np.int64)
+            order[a_pos]= a_inx
+            order[b_pos]= b_inx
+            nxt.append((val,order))
+
+        if len(merged) % 2:
+            nxt.append(merged[-1])
+        merged  = nxt
+
+    return merged[0][1]
+
+def combine_spots(spot_dfs,compact=False):
+    """
+    Combine spot dataframes from several sources into a single time-ordered
+    unified spot table.
+
+    Each source is aligned to the spot_keys() schema once and the sources are
+    concatenated in a single allocation. Since each source is (normally)
+    already time-ordered, the rows are then put in order with a k-way merge
+    on datetime instead of a full sort.
+
+    Set compact=True to return the table with compact_dtypes().
+    """
     print('Concatenating all dataframes...') 
-    df  = pd.DataFrame()
-    for inx,spot_df in enumerate(spot_dfs):
-        df  = df.append(spot_df,ignore_index=True)
-    df  = order_and_sort(df)
+    spot_dfs    = [x for x in spot_dfs if x is not None]
+    keys        = [dk for dk in spot_keys() if any(dk in x.columns for x in spot_dfs)]
+
+    runs    = []
+    for spot_df in spot_dfs:
+        # Columns a source lacks are added as object so that they do not
+        # turn the other sources' values (e.g. single_op) into floats.
+        missing = [dk for dk in keys if dk not in spot_df.columns]
+        spot_df = spot_df.reindex(columns=keys)
+        for dk in missing:
+            spot_df[dk] = spot_df[dk].astype(object)
+        if not spot_df['datetime'].is_monotonic_increasing:
+            spot_df = spot_df.sort_values('datetime',kind='mergesort')
+        runs.append(spot_df)
+
+    if len(runs) == 0:
+        return pd.DataFrame(columns=keys)
+
+    df      = pd.concat(runs,ignore_index=True)
+
+    tms     = [pd.to_datetime(x['datetime']).values.astype('datetime64[ns]') for x in runs]
+    order   = merge_sorted_runs(tms)
+    df      = df.take(order)
+    df.index    = list(range(len(df)))
+
+    if compact:
+        df  = compact_dtypes(df)
     return df
 
+def locate_calls(calls,qth_locator):
+    """
+    Geolocate each unique callsign once.
+        calls:          array-like of callsigns (may contain repeats and nulls)
+        qth_locator:    callable call --> (grid, grid_src). If it also has a
+                        locate_many(calls) method returning a list of
+                        (grid, grid_src), all calls are resolved in one batch.
+
+    Returns a dataframe indexed by callsign with columns grid and grid_src,
+    ready to be mapped back onto the spot columns.
+    """
+    calls   = pd.unique(pd.Series(calls).dropna())
+    print('Geolocating {:d} unique calls...'.format(len(calls)))
+
+    if hasattr(qth_locator,'locate_many'):
+        results = qth_locator.locate_many(list(calls))
+    else:
+        results = [qth_locator(call) for call in tqdm.tqdm(calls)]
+
+    if len(results) == 0:
+        grids, grid_srcs    = [], []
+    else:
+        grids, grid_srcs    = zip(*results)
+
+    locs    = pd.DataFrame({'grid':list(grids),'grid_src':list(grid_srcs)},index=calls,dtype=object)
+    return locs
+
 def clean_call(call):
     if not pd.isnull(call):
         call = call.replace('/','-').upper()
@@ -0,0 +1,202 @@
+import os
+import hashlib
+import inspect
+import functools
+
+import pandas as pd
+
+# Normalized dataframes are cached here, one file per cache key.
+# Override with the SEQP_CACHE_DIR environment variable.
+cache_dir   = os.environ.get('SEQP_CACHE_DIR',os.path.join('data','df_cache'))
+
+try:
+    import pyarrow
+    cache_fmt   = 'parquet'
+except ImportError:
+    cache_fmt   = 'pickle'
+
+_hash_memo  = {}
+
+def path_hash(path,block_sz=2**20):
+    """
+    SHA1 of the contents of a file, or of every file below a directory.
+    Hashes are memoized per process on (path, size, mtime).
+    """
+    if os.path.isdir(path):
+        files   = []
+        for root,dirs,fnames in os.walk(path):
+            dirs.sort()
+            for fname in sorted(fnames):
+                files.append(os.path.join(root,fname))
+    else:
+        files   = [path]
+
+    sha = hashlib.sha1()
+    for fpath in files:
+        stat    = os.stat(fpath)
+        memo_k  = (os.path.abspath(fpath),stat.st_size,stat.st_mtime)
+        digest  = _hash_memo.get(memo_k)
+        if digest is None:
+            fsha    = hashlib.sha1()
+            with open(fpath,'rb') as fl:
+                while True:
+                    buf = fl.read(block_sz)
+                    if not buf:
+                        break
+                    fsha.update(buf)
+            digest  = fsha.hexdigest()
+            _hash_memo[memo_k] = digest
+
+        sha.update(os.path.relpath(fpath,path).encode())
+        sha.update(digest.encode())
+    return sha.hexdigest()
+
+def _code_hash(code,sha):
+    """
+    Add the bytecode and constants of a code object (and of any nested
+    code objects) to sha.
+    """
+    sha.update(code.co_code)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            _code_hash(const,sha)
+        else:
+            sha.update(repr(const).encode())
+
+def locator_key(qth_locator):
+    """
+    Identity of a qth_locator for cache keys.
+        None:               'none'
+        has .cache_key:     that value (e.g. SeqpQTH)
+        plain function:     module.qualname plus a hash of its bytecode,
+                            constants and defaults, so editing the
+                            function invalidates the cache
+    Anything else, including lambdas and closures, cannot be identified
+    across runs and returns None, which disables caching.
+    """
+    if qth_locator is None:
+        return 'none'
+
+    key = getattr(qth_locator,'cache_key',None)
+    if key is not None:
+        return str(key)
+
+    if inspect.isfunction(qth_locator):
+        if qth_locator.__name__ == '<lambda>' or qth_locator.__closure__ is not None:
+            return None
+        sha = hashlib.sha1()
+        _code_hash(qth_locator.__code__,sha)
+        sha.update(repr(qth_locator.__defaults__).encode())
+        sha.update(repr(qth_locator.__kwdefaults__).encode())
+        return '{!s}.{!s}-{!s}'.format(qth_locator.__module__,qth_locator.__qualname__,sha.hexdigest())
+
+    return None
+
+def cache_key(path,reader,version,qth_locator=None,extra=None):
+    """
+    Content-addressed key for a normalized dataframe.
+    extra is an optional string identifying other inputs of the reader.
+    Returns None if the inputs cannot be keyed.
+    """
+    loc_key = locator_key(qth_locator)
+    if loc_key is None:
+        return None
+
+    sha = hashlib.sha1()
+    sha.update(path_hash(path).encode())
+    sha.update('{!s}:{!s}'.format(reader,version).encode())
+    sha.update(loc_key.encode())
+    if extra is not None:
+        sha.update(str(extra).encode())
+    return '{!s}-{!s}'.format(reader,sha.hexdigest())
+
+def load(key):
+    """
+    Load a cached dataframe, or return None on a miss.
+    """
+    for fmt in ['parquet','pickle']:
+        path    = os.path.join(cache_dir,'{!s}.{!s}'.format(key,fmt))
+        if not os.path.exists(path):
+            continue
+        if fmt == 'parquet':
+            if cache_fmt != 'parquet':
+                continue
+            return pd.read_parquet(path)
+        else:
+            return pd.read_pickle(path)
+    return None
+
+def save(key,df):
+    """
+    Store a dataframe under key. Parquet is used when pyarrow is available;
+    columns that Parquet cannot represent fall back to a pickle.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    fmt = cache_fmt
+    if fmt == 'parquet':
+        path    = os.path.join(cache_dir,'{!s}.parquet'.format(key))
+        tmp     = path + '.tmp'
+        try:
+            df.to_parquet(tmp)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            fmt = 'pickle'
+
+    if fmt == 'pickle':
+        path    = os.path.join(cache_dir,'{!s}.pickle'.format(key))
+        tmp     = path + '.tmp'
+        df.to_pickle(tmp)
+
+    # Rename into place so an interrupted write never leaves a bad entry.
+    os.replace(tmp,path)
+    return path
+
+def cached(reader,version,extra_key=None):
+    """
+    Decorator for the get_df() readers.
+
+    The first argument of the reader is the input file (or log directory).
+    Results are cached on the input's content hash, the reader name and
+    version, and the identity of the qth_locator argument, if any. Bump
+    version whenever the reader's output changes.
+
+    Readers that also depend on something other than their input file
+    (e.g. a database table) pass extra_key, a function of no arguments
+    returning a string that identifies the current state of that input.
+
+    Calls are passed straight through (no caching) when use_cache=False,
+    the input is not a path, the qth_locator cannot be identified, or an
+    output_dir is given (the reader then has side effects).
+    """
+    def decorator(get_df):
+        sig = inspect.signature(get_df)
+
+        @functools.wraps(get_df)
+        def wrapper(*args,use_cache=True,**kwargs):
+            bound   = sig.bind(*args,**kwargs)
+            bound.apply_defaults()
+            params  = list(bound.arguments.values())
+            path    = params[0]
+
+            key     = None
+            if (use_cache and isinstance(path,(str,os.PathLike)) and os.path.exists(path)
+                    and bound.arguments.get('output_dir') is None):
+                extra   = None if extra_key is None else extra_key()
+                key     = cache_key(path,reader,version,bound.arguments.get('qth_locator'),extra)
+
+            if key is not None:
+                df  = load(key)
+                if df is not None:
+                    print('Loaded {!s} dataframe from cache: {!s}'.format(reader,key))
+                    return df
+
+            df  = get_df(*args,**kwargs)
+
+            if key is not None:
+                save(key,df)
+            return df
+        return wrapper
+    return decorator
@@ -1,9 +1,11 @@
 from collections import OrderedDict
+import numpy as np
 import pandas as pd
-import tqdm
 
-from .data import clean_call
+from .data import clean_call, locate_calls
+from . import df_cache
 
+@df_cache.cached('dxcluster',version=1)
 def get_df(csv_file,qth_locator=None):
     """
     Reads a DXCluster CSV generated by generate_seqp_csv() into a
@@ -38,8 +40,8 @@ def get_df(csv_file,qth_locator=None):
 
     
     if qth_locator is not None:
-        tqdm.tqdm.pandas(tqdm.tqdm,leave=True)
         print('Geolocating DXCluster dataframe...')
+        locs    = locate_calls(np.concatenate([df['call_0'].values,df['call_1'].values]),qth_locator)
         for key in [0,1]:
             grid_k      = 'grid_{!s}'.format(key)
             grid_src_k  = 'grid_src_{!s}'.format(key)
@@ -47,11 +49,8 @@ def get_df(csv_file,qth_locator=None):
 
             print('{} --> {}'.format(call_k,grid_k))
 
-            result              = df[call_k].progress_apply(qth_locator)
-            grids, grid_srcs    = zip(*result)
-
-            df[grid_k]          = grids
-            df[grid_src_k]      = grid_srcs
+            df[grid_k]          = df[call_k].map(locs['grid'])
+            df[grid_src_k]      = df[call_k].map(locs['grid_src'])
 
     # Set Dataframe to MHz.
     df['frequency'] = df['frequency']/1.e3
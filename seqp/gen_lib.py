@@ -1,4 +1,5 @@
 import shutil,os
+import json
 
 def make_dir(path,clear=False,php=False):
     prep_output({0:path},clear=clear,php=php)
@@ -41,3 +42,14 @@ def prep_output(output_dirs={0:'output'},clear=False,width_100=False,img_extra='
                 file_obj.write(show_all_txt)
             with open(os.path.join(value,'0000-show_all_breaks.php'),'w') as file_obj:
                 file_obj.write(show_all_txt_breaks)
+
+def atomic_json_dump(obj,path,**kwargs):
+    """
+    Write obj to path as JSON. The file is written to path.tmp and renamed
+    into place, so an interrupted write never leaves a partial file.
+    kwargs are passed to json.dump().
+    """
+    tmp = path + '.tmp'
+    with open(tmp,'w') as fl:
+        json.dump(obj,fl,**kwargs)
+    os.replace(tmp,path)
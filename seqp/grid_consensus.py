@@ -0,0 +1,253 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from . import df_cache
+from . import locator
+
+# Bump when the consensus rules change; part of cache_key.
+consensus_version   = 2
+
+# grid_src of the grids each spot source reports itself, by the source
+# column of its frames. Other grid_src values in a frame were filled in by
+# a qth_locator and are not counted. RBN spots carry no reported grids, and
+# seqp_logs frames carry SeqpQTH results; SEQP reports are taken from
+# SeqpQTH.qth_counts instead (see seqp_reports()).
+reported_src    = OrderedDict()
+reported_src['pskreporter'] = 'pskr'
+reported_src['wspr']        = 'wspr'
+reported_src['dxcluster']   = 'dxcl'
+
+# Weight of one report by grid_src. Sources not listed are ignored. QRZ
+# results are not self-reported (and their license does not allow reuse).
+source_weights  = OrderedDict()
+source_weights['seqp_submitted']    = 10.
+source_weights['seqp_sent']         = 4.
+source_weights['seqp_rx']           = 1.
+source_weights['pskr']              = 2.
+source_weights['wspr']              = 2.
+source_weights['dxcl']              = 1.
+
+# Weight of one report by grid length.
+precision_weights   = OrderedDict()
+precision_weights[4]    = 1.
+precision_weights[6]    = 1.5
+
+def reports(df,weights=None):
+    """
+    Count the grids reported for each call in a spot dataframe with the
+    call_0/grid_0/grid_src_0, call_1/grid_1/grid_src_1 and source
+    columns. Only grids whose grid_src is the one the row's source reports
+    itself (reported_src) are counted.
+    Returns a dataframe of call, grid, source and count.
+    """
+    if weights is None:
+        weights = source_weights
+
+    if 'source' not in df.columns:
+        raise Exception('Spot dataframe has no source column.')
+    own_src = np.asarray(df['source'].astype(object).map(reported_src),dtype=object)
+
+    parts   = []
+    for key in [0,1]:
+        cols    = ['call_{!s}'.format(key),'grid_{!s}'.format(key),'grid_src_{!s}'.format(key)]
+        if not all(x in df.columns for x in cols):
+            continue
+        src     = np.asarray(df[cols[2]],dtype=object)
+        tf      = src == own_src
+        part    = pd.DataFrame({'call':np.asarray(df[cols[0]],dtype=object)[tf],
+                                'grid':np.asarray(df[cols[1]],dtype=object)[tf],
+                                'source':src[tf]})
+        parts.append(part)
+
+    rpts    = pd.concat(parts,ignore_index=True) if len(parts) > 0 else None
+    if rpts is not None:
+        rpts    = rpts[rpts['source'].isin([k for k,v in weights.items() if v > 0]).values]
+    if rpts is None or len(rpts) == 0:
+        return pd.DataFrame({'call':[],'grid':[],'source':[],'count':[]})
+
+    # Count distinct (call, grid, source) first so that the string work
+    # below runs once per distinct report rather than once per spot.
+    counts  = rpts.groupby(['call','grid','source'],sort=False).size().rename('count').reset_index()
+
+    tf      = np.logical_and(counts['call'].map(lambda x: isinstance(x,str)).values,
+                             counts['grid'].map(lambda x: isinstance(x,str)).values)
+    counts  = counts[tf].copy()
+    counts['call']  = counts['call'].str.upper()
+    counts['grid']  = counts['grid'].str.strip().str.upper()
+    counts  = counts.groupby(['call','grid','source'])['count'].sum().reset_index()
+    return counts
+
+def seqp_reports(qth):
+    """
+    Grids reported in the SEQP logs and submissions, from the raw report
+    counts of a SeqpQTH. Returns a dataframe like reports().
+    """
+    counts  = qth.qth_counts
+    return pd.DataFrame({'call':counts['call'].values.astype(object),
+                         'grid':counts['grid'].values.astype(object),
+                         'source':counts['source'].values.astype(object),
+                         'count':counts['count'].values.astype(np.int64)})
+
+class GridConsensus(object):
+    def __init__(self,counts,weights=None,min_weight=2.,min_share=0.5,fallback=None):
+        """
+        Callsign --> grid square table built from the grids that stations
+        report for themselves and for each other across all loaded sources.
+
+        counts is a dataframe of call, grid, source and count (see
+        reports() and from_frames()). Each report is weighted by its source
+        (weights, default source_weights) and by its precision
+        (precision_weights). Per call, the 4-character square with the
+        most weight wins. A 6-character grid in that square is used if it
+        holds at least half of the 6-character weight there; otherwise the
+        4-character square is returned.
+
+        Calls with less than min_weight in total, or whose winning square
+        has less than min_share of it, are left unresolved. These are passed
+        to fallback (another qth_locator, e.g. a SeqpQTH) if one is given.
+
+        Works as a qth_locator: call(call) and locate_many(calls) return
+        (grid, grid_src) with grid_src 'consensus'.
+        """
+        if weights is None:
+            weights = source_weights
+        self.weights    = weights
+        self.min_weight = min_weight
+        self.min_share  = min_share
+        self.fallback   = fallback
+        self.__create_table(counts)
+
+    @classmethod
+    def from_frames(cls,frames,qth=None,**kwargs):
+        """
+        Build a consensus from spot dataframes, e.g. the values of
+        loader.load_sources() or a data.combine_spots() table, plus the
+        SEQP reports of qth (a SeqpQTH), if given.
+        Each frame is reduced to report counts before they are combined.
+        """
+        if hasattr(frames,'columns'):
+            frames  = [frames]
+        elif hasattr(frames,'values'):
+            frames  = list(frames.values())
+
+        weights = kwargs.get('weights')
+        parts   = [reports(df,weights) for df in frames if df is not None]
+        if qth is not None:
+            parts.append(seqp_reports(qth))
+        parts   = [x for x in parts if len(x) > 0]
+        if len(parts) == 0:
+            counts  = pd.DataFrame({'call':[],'grid':[],'source':[],'count':[]})
+        else:
+            counts  = pd.concat(parts,ignore_index=True)
+            counts  = counts.groupby(['call','grid','source'])['count'].sum().reset_index()
+        return cls(counts,**kwargs)
+
+    def __create_table(self,counts):
+        print('Building grid consensus...')
+        counts  = counts.copy()
+        counts['call']  = counts['call'].astype(object).str.upper()
+        counts['grid']  = counts['grid'].astype(object).str.upper()
+
+        # Validate each distinct grid once; longer grids are cut to 6 characters.
+        grids   = pd.unique(counts['grid'])
+        if len(grids) > 0:
+            valid   = pd.Series(locator.grid_valid(np.array(grids,dtype=object)).astype(bool),index=grids)
+        else:
+            valid   = pd.Series([],dtype=bool)
+        counts  = counts[counts['grid'].map(valid).values.astype(bool)]
+        counts['grid']  = counts['grid'].str.slice(0,6)
+        counts  = counts[counts['grid'].str.len().isin(list(precision_weights.keys())).values].copy()
+
+        src_w   = counts['source'].map(self.weights).astype(float).fillna(0.).values
+        prc_w   = counts['grid'].str.len().map(precision_weights).astype(float).values
+        counts['weight']    = counts['count'].values.astype(float) * src_w * prc_w
+        counts['square']    = counts['grid'].str.slice(0,4)
+        counts  = counts[counts['weight'].values > 0]
+
+        # Vote on the 4-character square.
+        total   = counts.groupby('call')['weight'].sum()
+        nrpt    = counts.groupby('call')['count'].sum()
+        squares = counts.groupby(['call','square'])['weight'].sum().reset_index()
+        squares = squares.sort_values(['call','weight','square'],
+                                      ascending=[True,False,False],kind='mergesort')
+        best    = squares.drop_duplicates('call').set_index('call')
+
+        # Refine to a 6-character grid within the winning square.
+        subs    = counts[counts['grid'].str.len().values == 6]
+        subs    = subs[subs['square'].values == best['square'].reindex(subs['call']).values]
+        subs    = subs.groupby(['call','grid'])['weight'].sum().reset_index()
+        sub_tot = subs.groupby('call')['weight'].sum()
+        subs    = subs.sort_values(['call','weight','grid'],
+                                   ascending=[True,False,False],kind='mergesort')
+        sub_bst = subs.drop_duplicates('call').set_index('call')
+        sub_ok  = sub_bst['weight'] >= 0.5*sub_tot.reindex(sub_bst.index)
+        sub_grd = sub_bst['grid'][sub_ok]
+
+        calls   = best.index
+        grid    = np.array(sub_grd.reindex(calls).values,dtype=object)
+        missing = pd.isnull(grid)
+        grid[missing]   = best['square'].values[missing]
+
+        table   = pd.DataFrame(index=pd.Index(calls,dtype=object,name='call'))
+        table['grid']       = grid
+        table['weight']     = total.reindex(calls).values.astype(np.float32)
+        table['share']      = (best['weight'].values/total.reindex(calls).values).astype(np.float32)
+        table['reports']    = nrpt.reindex(calls).values.astype(np.int64)
+
+        tf      = np.logical_and(table['weight'].values >= self.min_weight,
+                                 table['share'].values >= self.min_share)
+        table   = table[tf]
+        table['grid']       = table['grid'].astype('category')
+        self.table  = table
+        print('Grid consensus for {:d} of {:d} calls.'.format(len(table),len(calls)))
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def cache_key(self):
+        """
+        Identity for df_cache: changes whenever the table, the rules or the
+        fallback change. None if the fallback cannot be identified, e.g. a
+        SeqpQTH that falls back to live QRZ.com lookups.
+        """
+        fb_key  = None if self.fallback is None else df_cache.locator_key(self.fallback)
+        if self.fallback is not None and fb_key is None:
+            return None
+
+        sha = hashlib.sha1()
+        sha.update('{!s}:{!s}:{!s}'.format(consensus_version,self.min_weight,self.min_share).encode())
+        sha.update(repr(sorted(self.weights.items())).encode())
+        sha.update('\n'.join(self.table.index.values).encode())
+        sha.update('\n'.join(self.table['grid'].astype(str).values).encode())
+        sha.update(str(fb_key).encode())
+        return 'consensus-{!s}'.format(sha.hexdigest())
+
+    def locate_many(self,calls):
+        """
+        Resolve many calls at once. Returns a list of (grid, grid_src);
+        (None, None) for calls that neither the consensus nor the fallback
+        can place.
+        """
+        keys    = [x.upper() if isinstance(x,str) else None for x in calls]
+        inx     = self.table.index.get_indexer(pd.Index(keys,dtype=object))
+        grids   = np.asarray(self.table['grid'].astype(object).values)
+        results = [(grids[x],'consensus') if x >= 0 else (None,None) for x in inx]
+
+        if self.fallback is not None:
+            todo    = [i for i,x in enumerate(inx) if x < 0 and keys[i] is not None]
+            if len(todo) > 0:
+                fb_calls    = [calls[i] for i in todo]
+                if hasattr(self.fallback,'locate_many'):
+                    fb_res  = self.fallback.locate_many(fb_calls)
+                else:
+                    fb_res  = [self.fallback(x) for x in fb_calls]
+                for i,res in zip(todo,fb_res):
+                    results[i]  = tuple(res)
+        return results
+
+    def __call__(self,call):
+        return self.locate_many([call])[0]
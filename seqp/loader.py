@@ -0,0 +1,82 @@
+import time
+import inspect
+import importlib
+import multiprocessing as mp
+from collections import OrderedDict
+
+import pandas as pd
+
+# Source name --> module providing get_df().
+source_modules  = OrderedDict()
+source_modules['rbn']           = 'rbn'
+source_modules['wspr']          = 'wspr'
+source_modules['pskreporter']   = 'pskreporter'
+source_modules['dxcluster']     = 'dxcluster'
+source_modules['seqp_logs']     = 'seqp_logs'
+
+def _load_source(run_dct):
+    """
+    Process pool worker for load_sources(). Runs one source's get_df()
+    and times it.
+    """
+    name        = run_dct['name']
+    module      = importlib.import_module('.'+source_modules[name],__package__)
+    get_df      = module.get_df
+
+    kwargs      = {}
+    params      = inspect.signature(get_df).parameters
+    if run_dct['qth_locator'] is not None and 'qth_locator' in params:
+        kwargs['qth_locator']   = run_dct['qth_locator']
+
+    t0          = time.time()
+    df          = get_df(run_dct['path'],**kwargs)
+    elapsed     = time.time() - t0
+    return (name,df,elapsed)
+
+def load_sources(sources,qth_locator=None,processes=None):
+    """
+    Load several spot sources concurrently, one source per worker in a
+    process pool.
+        sources:        dictionary of source name --> input file.
+                        Names are the keys of source_modules ('rbn', 'wspr',
+                        'pskreporter', 'dxcluster', 'seqp_logs').
+        qth_locator:    passed to the readers that geolocate calls.
+                        It must be picklable (e.g. a SeqpQTH object or a
+                        module-level function).
+        processes:      pool size; defaults to one worker per source.
+
+    Returns (frames, timing): an OrderedDict of source name --> dataframe,
+    ready for data.combine_spots(frames.values()), and an OrderedDict of
+    source name --> seconds spent in that source's reader.
+    """
+    for name in sources.keys():
+        if name not in source_modules:
+            raise Exception('Unknown source: {!s}'.format(name))
+
+    run_list    = []
+    for name,path in sources.items():
+        tmp = {}
+        tmp['name']         = name
+        tmp['path']         = path
+        tmp['qth_locator']  = qth_locator
+        run_list.append(tmp)
+
+    if processes is None:
+        processes   = min(len(run_list),mp.cpu_count())
+
+    t0  = time.time()
+    if processes <= 1:
+        results = [_load_source(x) for x in run_list]
+    else:
+        with mp.Pool(processes) as pool:
+            results = pool.map(_load_source,run_list)
+
+    frames  = OrderedDict()
+    timing  = OrderedDict()
+    for name,df,elapsed in results:
+        frames[name]    = df
+        timing[name]    = elapsed
+
+    print('Loaded {:d} sources in {:.1f} s:'.format(len(frames),time.time()-t0))
+    print(pd.Series(timing,name='seconds').to_string())
+    return frames,timing
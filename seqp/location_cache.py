@@ -0,0 +1,253 @@
+import math
+import sqlite3
+import datetime
+
+import pandas as pd
+
+from .location_history import LocationHistory
+
+class LocationCache(object):
+    """
+    Client for the callsign location_cache table.
+
+    Subclasses provide connect() and the DB-API placeholder style; lookups
+    and inserts are batched so that a whole set of callsigns costs one
+    query per chunk and one commit.
+    """
+    placeholder = '%s'
+    chunk_size  = 500
+
+    def connect(self):
+        raise NotImplementedError
+
+    def lookup(self,callsign,negative_ttl=None):
+        """
+        Return (lat, lon) for a single callsign, or None on a miss.
+        """
+        return self.lookup_many([callsign],negative_ttl=negative_ttl).get(callsign)
+
+    def lookup_many(self,calls,negative_ttl=None):
+        """
+        Look up many callsigns with parameterized WHERE callsign IN (...)
+        queries. Returns a dictionary of callsign --> (lat, lon) for the
+        calls found; missing calls are left out. If a call has several
+        stored locations, the most recent one is returned.
+
+        Failed lookups are stored with NULL lat/lon (see insert_many()).
+        They are returned as (nan, nan) if they are younger than
+        negative_ttl seconds (None: never expire), and are otherwise
+        treated as misses. A stored location always wins over a failure.
+        Rows limited to a validity interval are ignored here; see
+        history_many().
+        """
+        calls   = list(calls)
+        result  = {}
+        if len(calls) == 0:
+            return result
+
+        now     = datetime.datetime.now()
+        failed  = {}
+
+        db      = self.connect()
+        try:
+            crsr    = db.cursor()
+            for inx in range(0,len(calls),self.chunk_size):
+                chunk   = calls[inx:inx+self.chunk_size]
+                plc     = ','.join([self.placeholder]*len(chunk))
+                qry     = ("SELECT callsign,lat,lon,lookup_datetime FROM location_cache "
+                           "WHERE valid_from IS NULL AND valid_to IS NULL "
+                           "AND callsign IN ({}) "
+                           "ORDER BY lookup_datetime DESC;".format(plc))
+                crsr.execute(qry,tuple(chunk))
+                for callsign,lat,lon,lookup_datetime in crsr.fetchall():
+                    if lat is not None:
+                        if callsign not in result:
+                            result[callsign] = (lat,lon)
+                        continue
+                    if callsign in failed:
+                        continue
+
+                    if isinstance(lookup_datetime,str):
+                        lookup_datetime = datetime.datetime.strptime(lookup_datetime,'%Y-%m-%d %H:%M:%S')
+                    age = (now - lookup_datetime).total_seconds()
+                    if negative_ttl is None or age < negative_ttl:
+                        failed[callsign] = (float('nan'),float('nan'))
+            crsr.close()
+        finally:
+            db.close()
+
+        for callsign,latlon in failed.items():
+            if callsign not in result:
+                result[callsign] = latlon
+        return result
+
+    def history_many(self,calls):
+        """
+        Load every stored location of the given calls, with its lookup time
+        and validity interval, into a LocationHistory.
+        """
+        calls   = list(calls)
+        rows    = []
+        if len(calls) == 0:
+            return LocationHistory.from_rows(rows)
+
+        db      = self.connect()
+        try:
+            crsr    = db.cursor()
+            for inx in range(0,len(calls),self.chunk_size):
+                chunk   = calls[inx:inx+self.chunk_size]
+                plc     = ','.join([self.placeholder]*len(chunk))
+                qry     = ("SELECT callsign,lat,lon,lookup_datetime,valid_from,valid_to FROM location_cache "
+                           "WHERE lat IS NOT NULL AND callsign IN ({});".format(plc))
+                crsr.execute(qry,tuple(chunk))
+                rows.extend(crsr.fetchall())
+            crsr.close()
+        finally:
+            db.close()
+        return LocationHistory.from_rows(rows)
+
+    def insert_many(self,rows,lookup_source='qrz'):
+        """
+        Insert (callsign, lat, lon) rows with a single commit.
+        A NaN or None lat/lon records a failed lookup (stored as NULL).
+        Earlier failed lookups of the same calls are deleted, so retrying a
+        call does not pile up NULL rows.
+        """
+        rows    = list(rows)
+        if len(rows) == 0:
+            return
+
+        def null(val):
+            if val is None or math.isnan(val):
+                return None
+            return val
+
+        lookup_datetime = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        data    = [(call,null(lat),null(lon),lookup_source,lookup_datetime) for call,lat,lon in rows]
+
+        plc     = ','.join([self.placeholder]*5)
+        qry     = ("INSERT INTO location_cache "
+                   "(callsign,lat,lon,lookup_source,lookup_datetime) "
+                   "VALUES ({});".format(plc))
+
+        calls   = list(dict.fromkeys([x[0] for x in data]))
+        db      = self.connect()
+        try:
+            crsr    = db.cursor()
+            for inx in range(0,len(calls),self.chunk_size):
+                chunk   = calls[inx:inx+self.chunk_size]
+                dlt     = ("DELETE FROM location_cache "
+                           "WHERE lat IS NULL AND valid_from IS NULL AND valid_to IS NULL "
+                           "AND callsign IN ({});".format(','.join([self.placeholder]*len(chunk))))
+                crsr.execute(dlt,tuple(chunk))
+            crsr.executemany(qry,data)
+            db.commit()
+            crsr.close()
+        finally:
+            db.close()
+
+    def insert_intervals(self,rows,lookup_source='manual'):
+        """
+        Insert (callsign, lat, lon, valid_from, valid_to) rows: locations
+        known to hold only for a period, e.g. a portable operation or a
+        call that moved. None leaves that bound open.
+        """
+        rows    = list(rows)
+        if len(rows) == 0:
+            return
+
+        def fmt(val):
+            if val is None or pd.isnull(val):
+                return None
+            return val.strftime('%Y-%m-%d %H:%M:%S')
+
+        lookup_datetime = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        data    = [(call,lat,lon,lookup_source,lookup_datetime,fmt(v_0),fmt(v_1))
+                    for call,lat,lon,v_0,v_1 in rows]
+
+        plc     = ','.join([self.placeholder]*7)
+        qry     = ("INSERT INTO location_cache "
+                   "(callsign,lat,lon,lookup_source,lookup_datetime,valid_from,valid_to) "
+                   "VALUES ({});".format(plc))
+
+        db      = self.connect()
+        try:
+            crsr    = db.cursor()
+            crsr.executemany(qry,data)
+            db.commit()
+            crsr.close()
+        finally:
+            db.close()
+
+class MySqlLocationCache(LocationCache):
+    def __init__(self,user='hamsci',password='hamsci',host='localhost',database='seqp_analysis',
+            pool_name='location_cache',pool_size=4):
+        """
+        location_cache client backed by a mysql.connector connection pool.
+        The table itself is created by rbn.MySqlEclipse.
+        """
+        import mysql.connector.pooling
+        self.pool   = mysql.connector.pooling.MySQLConnectionPool(pool_name=pool_name,
+                        pool_size=pool_size,user=user,password=password,host=host,database=database)
+
+    def connect(self):
+        # close() on a pooled connection returns it to the pool.
+        return self.pool.get_connection()
+
+class SqliteLocationCache(LocationCache):
+    placeholder = '?'
+
+    def __init__(self,path=':memory:'):
+        """
+        Local stand-in for the MySQL location_cache, with the same schema
+        and interface. Useful for tests and for running without a server.
+        """
+        self.path   = path
+        self.__db   = None
+        if path == ':memory:':
+            # An in-memory database only lives as long as its connection.
+            self.__db   = sqlite3.connect(path)
+
+        db  = self.connect()
+        db.execute('''
+                   CREATE TABLE IF NOT EXISTS location_cache (
+                   callsign VARCHAR(20),
+                   lat FLOAT,
+                   lon FLOAT,
+                   lookup_source VARCHAR(20),
+                   lookup_datetime DATETIME,
+                   valid_from DATETIME,
+                   valid_to DATETIME
+                   );
+                   ''')
+        cols    = [x[1] for x in db.execute('PRAGMA table_info(location_cache);')]
+        for col in ['valid_from','valid_to']:
+            if col not in cols:
+                db.execute('ALTER TABLE location_cache ADD COLUMN {!s} DATETIME;'.format(col))
+        db.execute('CREATE INDEX IF NOT EXISTS location_cache_callsign ON location_cache (callsign);')
+        db.commit()
+        db.close()
+
+    def connect(self):
+        if self.__db is not None:
+            return _SharedConnection(self.__db)
+        return sqlite3.connect(self.path)
+
+class _SharedConnection(object):
+    """
+    Wrap a long-lived sqlite3 connection so close() leaves it open.
+    """
+    def __init__(self,db):
+        self.db = db
+
+    def cursor(self):
+        return self.db.cursor()
+
+    def execute(self,*args):
+        return self.db.execute(*args)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        pass
@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+# Times are held as int64 seconds since 1970 and packed below the call code
+# into one sort key: key = code << time_bits | seconds.
+time_bits   = 33
+time_max    = 2**time_bits - 1
+
+def to_seconds(times):
+    """
+    Convert datetimes (NaT/None for an open bound) to clamped int64 seconds.
+    Returns (seconds, isnull).
+    """
+    times   = pd.DatetimeIndex(pd.to_datetime(np.asarray(times)))
+    isnull  = np.asarray(times.isna())
+    secs    = np.zeros(len(times),dtype=np.int64)
+    secs[~isnull] = times[~isnull].values.astype('datetime64[s]').astype(np.int64)
+    secs    = np.clip(secs,0,time_max)
+    return secs,isnull
+
+def split_overlaps(starts,ends):
+    """
+    Split the intervals of one call into disjoint segments. Where
+    intervals overlap, the one that starts last wins (ties: the later one
+    in the input), e.g. a portable trip inside a longer home interval.
+    Returns (starts, ends, index into the input) of the segments.
+    """
+    bounds  = np.unique(np.concatenate([starts,ends]))
+    seg_s, seg_e, seg_i = [], [], []
+    for b_0,b_1 in zip(bounds[:-1],bounds[1:]):
+        cover   = np.flatnonzero(np.logical_and(starts <= b_0,ends > b_0))
+        if len(cover) == 0:
+            continue
+        win     = cover[np.lexsort((cover,starts[cover]))[-1]]
+        if len(seg_i) > 0 and seg_i[-1] == win and seg_e[-1] == b_0:
+            seg_e[-1]   = b_1
+        else:
+            seg_s.append(b_0)
+            seg_e.append(b_1)
+            seg_i.append(win)
+    return (np.array(seg_s,dtype=np.int64),np.array(seg_e,dtype=np.int64),
+            np.array(seg_i,dtype=np.int64))
+
+class IntervalIndex(object):
+    def __init__(self,codes,starts,ends,lats,lons):
+        """
+        Sorted index of [start, end) validity intervals per call code.
+        All arguments are equal-length arrays; times are int64 seconds.
+
+        Overlapping intervals of a call are split into disjoint segments
+        (see split_overlaps()), so the segment that starts last at or
+        before a time is the only one that can cover it.
+        """
+        codes   = np.asarray(codes,dtype=np.int64)
+        starts  = np.asarray(starts,dtype=np.int64)
+        ends    = np.asarray(ends,dtype=np.int64)
+        lats    = np.asarray(lats,dtype=float)
+        lons    = np.asarray(lons,dtype=float)
+
+        keys    = (codes << time_bits) | starts
+        order   = np.argsort(keys,kind='mergesort')
+        codes, starts, ends = codes[order], starts[order], ends[order]
+        lats, lons          = lats[order], lons[order]
+
+        # Only calls with an interval that overlaps the next one need splitting.
+        overlap = np.logical_and(codes[1:] == codes[:-1],ends[:-1] > starts[1:])
+        split   = np.isin(codes,codes[1:][overlap])
+        if split.any():
+            parts   = [(codes[~split],starts[~split],ends[~split],lats[~split],lons[~split])]
+            for inx in np.split(np.flatnonzero(split),np.flatnonzero(np.diff(codes[split]))+1):
+                seg_s, seg_e, seg_i = split_overlaps(starts[inx],ends[inx])
+                parts.append((codes[inx][seg_i],seg_s,seg_e,lats[inx][seg_i],lons[inx][seg_i]))
+            codes, starts, ends, lats, lons = [np.concatenate(x) for x in zip(*parts)]
+
+        keys        = (codes << time_bits) | starts
+        order       = np.argsort(keys,kind='mergesort')
+        self.keys   = keys[order]
+        self.codes  = codes[order]
+        self.ends   = ends[order]
+        self.lats   = lats[order]
+        self.lons   = lons[order]
+
+    def locate(self,codes,times):
+        """
+        For each (code, time), return the index of the interval that starts
+        last at or before time and has not ended, or -1.
+        """
+        result  = np.full(len(codes),-1,dtype=np.int64)
+        if len(self.keys) == 0:
+            return result
+
+        known   = codes >= 0
+        qkeys   = (codes[known].astype(np.int64) << time_bits) | times[known]
+        inx     = np.searchsorted(self.keys,qkeys,side='right') - 1
+        inx_c   = np.maximum(inx,0)
+        ok      = np.logical_and(inx >= 0,self.codes[inx_c] == codes[known])
+        ok      = np.logical_and(ok,times[known] < self.ends[inx_c])
+        result[np.flatnonzero(known)[ok]] = inx[ok]
+        return result
+
+class LocationHistory(object):
+    def __init__(self,intervals=None):
+        """
+        Callsign locations with validity intervals.
+
+        intervals is a dataframe with columns callsign, lat, lon,
+        valid_from and valid_to (NaT for an open bound). Calls are coded
+        into integers and the intervals are sorted by (call, valid_from),
+        so locate() resolves a whole table of (call, time) pairs with one
+        vectorized binary search.
+
+        Explicit intervals take precedence over intervals derived from
+        lookups (see from_rows()). Where explicit intervals overlap, the
+        one that starts last applies (e.g. a portable trip nested in a
+        longer home interval).
+        """
+        cols    = ['callsign','lat','lon','valid_from','valid_to','explicit']
+        if intervals is None:
+            intervals   = pd.DataFrame(columns=cols)
+        intervals   = intervals.copy()
+        if 'explicit' not in intervals:
+            intervals['explicit']   = True
+        self.intervals  = intervals[cols].reset_index(drop=True)
+
+        self.calls      = pd.Index(pd.unique(self.intervals['callsign'].astype(object)))
+        self.indexes    = []
+        for explicit in [True,False]:
+            ivs     = self.intervals[self.intervals['explicit'].astype(bool) == explicit]
+            codes   = self.calls.get_indexer(ivs['callsign'].astype(object))
+            starts,s_null   = to_seconds(ivs['valid_from'].values)
+            ends,e_null     = to_seconds(ivs['valid_to'].values)
+            starts[s_null]  = 0
+            ends[e_null]    = time_max + 1
+            lats    = ivs['lat'].values.astype(float)
+            lons    = ivs['lon'].values.astype(float)
+            self.indexes.append(IntervalIndex(codes,starts,ends,lats,lons))
+
+    @classmethod
+    def from_rows(cls,rows):
+        """
+        Build a history from location_cache rows of
+        (callsign, lat, lon, lookup_datetime, valid_from, valid_to).
+
+        Rows with a valid_from or valid_to are used as explicit intervals.
+        For the other rows, each call's lookups are ordered by
+        lookup_datetime: the first location is valid from the beginning
+        of time, and each later, different location takes over at its
+        lookup time. The last location stays valid.
+        """
+        cols    = ['callsign','lat','lon','lookup_datetime','valid_from','valid_to']
+        df      = pd.DataFrame(list(rows),columns=cols)
+        for col in ['lookup_datetime','valid_from','valid_to']:
+            df[col] = pd.to_datetime(df[col])
+        df      = df.dropna(subset=['lat','lon'])
+
+        tf          = np.logical_or(df['valid_from'].notna().values,df['valid_to'].notna().values)
+        explicit    = df[tf].copy()
+        explicit['explicit'] = True
+
+        lkp     = df[~tf].sort_values(['callsign','lookup_datetime'],kind='mergesort')
+        # Drop repeated lookups that did not change the location.
+        new_call    = (lkp['callsign'] != lkp['callsign'].shift()).values
+        moved       = np.logical_or(lkp['lat'] != lkp['lat'].shift(),lkp['lon'] != lkp['lon'].shift()).values
+        lkp         = lkp[np.logical_or(new_call,moved)].copy()
+
+        new_call    = (lkp['callsign'] != lkp['callsign'].shift()).values
+        lkp['valid_from']   = lkp['lookup_datetime'].where(~new_call)
+        next_call   = (lkp['callsign'] != lkp['callsign'].shift(-1)).values
+        lkp['valid_to']     = lkp['lookup_datetime'].shift(-1).where(~next_call)
+        lkp['explicit']     = False
+
+        return cls(pd.concat([explicit,lkp],ignore_index=True))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def locate(self,calls,times):
+        """
+        Location of each call at the matching time.
+        Returns (lat, lon) arrays with NaN where no interval applies.
+        """
+        codes       = self.calls.get_indexer(pd.Index(np.asarray(calls,dtype=object)))
+        secs,isnull = to_seconds(times)
+        codes[isnull] = -1
+
+        lats    = np.full(len(codes),np.nan)
+        lons    = np.full(len(codes),np.nan)
+        todo    = np.ones(len(codes),dtype=bool)
+        for index in self.indexes:
+            inx     = index.locate(np.where(todo,codes,-1),secs)
+            hit     = inx >= 0
+            lats[hit]   = index.lats[inx[hit]]
+            lons[hit]   = index.lons[inx[hit]]
+            todo[hit]   = False
+        return lats,lons
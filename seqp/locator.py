@@ -185,8 +185,8 @@ def latlon2gridsquare(lat,lon,precision=6):
     zLats_rem        = zLats % container_size_lat
     zLons_rem        = zLons % container_size_lon
 
-    lat_code_inx     = np.array(np.floor(zLats_rem / subdivide_size_lat),dtype=np.int)
-    lon_code_inx     = np.array(np.floor(zLons_rem / subdivide_size_lon),dtype=np.int)
+    lat_code_inx     = np.array(np.floor(zLats_rem / subdivide_size_lat),dtype=int)
+    lon_code_inx     = np.array(np.floor(zLons_rem / subdivide_size_lon),dtype=int)
 
     lon_code  = alpha_upper[lon_code_inx]
     lat_code  = alpha_upper[lat_code_inx]
@@ -215,8 +215,8 @@ def latlon2gridsquare(lat,lon,precision=6):
         zLats_rem        = zLats_rem % container_size_lat
         zLons_rem        = zLons_rem % container_size_lon
 
-        lat_code_inx     = np.array(np.floor(zLats_rem / subdivide_size_lat),dtype=np.int)
-        lon_code_inx     = np.array(np.floor(zLons_rem / subdivide_size_lon),dtype=np.int)
+        lat_code_inx     = np.array(np.floor(zLats_rem / subdivide_size_lat),dtype=int)
+        lon_code_inx     = np.array(np.floor(zLons_rem / subdivide_size_lon),dtype=int)
 
         lon_code    = str_code[lon_code_inx]
         lat_code    = str_code[lat_code_inx]
@@ -231,22 +231,34 @@ def latlon2gridsquare(lat,lon,precision=6):
         
     return ret_arr
 
-gs_latlon_cache = {}
-gs_latlon_cache['center']       = {}
-gs_latlon_cache['lower left']   = {}
-gs_latlon_cache['upper left']   = {}
-gs_latlon_cache['upper right']  = {}
-gs_latlon_cache['lower right']  = {}
+# Grid square --> (lat, lon) for any cell position, in a bounded LRU.
+# These are cheap to recompute, so there is no on-disk tier.
+@lru_cache(maxsize=100000)
 def gs2latlon_cached(gridsquare,position='center'):
-    result  = gs_latlon_cache[position].get(gridsquare)
-    if result is None:
-        try:
-            result  = gridsquare2latlon(gridsquare,position=position)
-        except:
-            result  = (np.nan,np.nan)
-        gs_latlon_cache[position][gridsquare] = result
+    try:
+        result  = gridsquare2latlon(gridsquare,position=position)
+    except (KeyError,IndexError,ValueError,TypeError):
+        # Malformed grid square.
+        result  = (np.nan,np.nan)
     return result
 
+def square2latlon(grids):
+    """
+    Centers of the 4-character squares of an array of grid squares,
+    computed directly from the character codes. Grids that do not start
+    with a valid square (e.g. 'FN2' or 'ZZ99') give NaN.
+    Returns (lat, lon) arrays.
+    """
+    squares = pd.Series(np.asarray(grids,dtype=object),dtype=object).str.slice(0,4).str.upper()
+    ok      = squares.str.match(r'^[A-R]{2}[0-9]{2}$').fillna(False).values.astype(bool)
+
+    lat     = np.full(len(squares),np.nan)
+    lon     = np.full(len(squares),np.nan)
+    codes   = np.array(squares[ok].tolist(),dtype='S4').view(np.uint8).reshape(-1,4).astype(float)
+    lon[ok] = (codes[:,0]-ord('A'))*20. + (codes[:,2]-ord('0'))*2. - 180. + 1.
+    lat[ok] = (codes[:,1]-ord('A'))*10. + (codes[:,3]-ord('0'))*1. -  90. + 0.5
+    return lat,lon
+
 def gridsquare2latlon(gridsquare,position='center'):
     """
     Calculates lat,lon pairs from gridsquares.
@@ -299,13 +311,13 @@ def gridsquare2latlon(gridsquare,position='center'):
         alpha = not bool(pos/2 % 2)
         
         if alpha:
-            lon_inx = np.array(alpha_pd.loc[lon_code].tolist(),dtype=np.float)
+            lon_inx = np.array(alpha_pd.loc[lon_code].tolist(),dtype=float)
 
-            lat_inx = np.array(alpha_pd.loc[lat_code].tolist(),dtype=np.float)
+            lat_inx = np.array(alpha_pd.loc[lat_code].tolist(),dtype=float)
             if pos != 0: base = 24.
         else:
-            lon_inx = np.array(lon_code,dtype=np.float)
-            lat_inx = np.array(lat_code,dtype=np.float)
+            lon_inx = np.array(lon_code,dtype=float)
+            lat_inx = np.array(lat_code,dtype=float)
 
             base = 10.
 
@@ -344,8 +356,8 @@ def gridsquare2latlon(gridsquare,position='center'):
         lon += container_size_lon
     
     # Convert things back to include NaNs.
-    ret_lat     = np.ndarray([gs_1.size],dtype=np.float)
-    ret_lon     = np.ndarray([gs_1.size],dtype=np.float)
+    ret_lat     = np.ndarray([gs_1.size],dtype=float)
+    ret_lon     = np.ndarray([gs_1.size],dtype=float)
 
     ret_lat[:]  = np.nan
     ret_lon[:]  = np.nan
@@ -0,0 +1,130 @@
+import os
+import json
+import pickle
+import hashlib
+
+from . import df_cache
+from . import gen_lib
+
+class LogManifest(object):
+    def __init__(self,name='seqp_logs',version=1,cache_dir=None):
+        """
+        Manifest of parsed input files and their cached parse results.
+
+        Each file is recorded by absolute path with its size, mtime and
+        content SHA1, next to a pickled chunk holding whatever the parser
+        returned for it. A file whose size and mtime are unchanged is
+        reused without reading it; if only the mtime changed, the content
+        hash decides. Bump version when the parser's output changes.
+
+        Files live in cache_dir/name (default: df_cache.cache_dir).
+        """
+        if cache_dir is None:
+            cache_dir   = df_cache.cache_dir
+        self.name           = name
+        self.version        = version
+        self.dir            = os.path.join(cache_dir,name)
+        self.manifest_path  = os.path.join(self.dir,'manifest.json')
+        self.entries        = self.load_manifest()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path,'r') as fl:
+            return json.load(fl)
+
+    def save(self):
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        gen_lib.atomic_json_dump(self.entries,self.manifest_path,indent=1,sort_keys=True)
+
+    def __chunk_path(self,chunk):
+        return os.path.join(self.dir,chunk)
+
+    def lookup(self,path):
+        """
+        Return the cached parse result for path, or None if the file is
+        new, changed, or was parsed by another version.
+        """
+        key     = os.path.abspath(path)
+        entry   = self.entries.get(key)
+        if entry is None or entry['version'] != self.version:
+            return None
+
+        stat    = os.stat(path)
+        if entry['size'] != stat.st_size:
+            return None
+        if entry['mtime'] != stat.st_mtime:
+            if df_cache.path_hash(path) != entry['sha1']:
+                return None
+            # Touched but not modified.
+            entry['mtime']  = stat.st_mtime
+
+        chunk_path  = self.__chunk_path(entry['chunk'])
+        if not os.path.exists(chunk_path):
+            return None
+        with open(chunk_path,'rb') as fl:
+            return pickle.load(fl)
+
+    def store(self,path,result):
+        """
+        Cache the parse result for path and record it in the manifest.
+        Call save() to write the manifest.
+        """
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+
+        key     = os.path.abspath(path)
+        stat    = os.stat(path)
+        sha1    = df_cache.path_hash(path)
+        chunk   = hashlib.sha1('{!s}:{!s}:{!s}'.format(key,sha1,self.version).encode()).hexdigest() + '.pickle'
+
+        chunk_path  = self.__chunk_path(chunk)
+        tmp         = chunk_path + '.tmp'
+        with open(tmp,'wb') as fl:
+            pickle.dump(result,fl,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp,chunk_path)
+
+        old = self.entries.get(key)
+        if old is not None and old['chunk'] != chunk and os.path.exists(self.__chunk_path(old['chunk'])):
+            os.remove(self.__chunk_path(old['chunk']))
+
+        entry   = {}
+        entry['size']       = stat.st_size
+        entry['mtime']      = stat.st_mtime
+        entry['sha1']       = sha1
+        entry['chunk']      = chunk
+        entry['version']    = self.version
+        self.entries[key]   = entry
+
+    def prune(self,paths,root):
+        """
+        Forget files below root that are not in paths (e.g. deleted logs).
+        """
+        root    = os.path.join(os.path.abspath(root),'')
+        keep    = set(os.path.abspath(x) for x in paths)
+        for key in list(self.entries.keys()):
+            if key.startswith(root) and key not in keep:
+                chunk_path  = self.__chunk_path(self.entries[key]['chunk'])
+                if os.path.exists(chunk_path):
+                    os.remove(chunk_path)
+                del self.entries[key]
+
+    def signature(self,paths):
+        """
+        SHA1 identifying the current contents of a set of files. Files
+        whose size and mtime match their manifest entry use the recorded
+        hash; others are hashed. Used to tell whether results derived
+        from the files are stale.
+        """
+        sha = hashlib.sha1()
+        for key in sorted(os.path.abspath(x) for x in paths):
+            entry   = self.entries.get(key)
+            stat    = os.stat(key)
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                digest  = entry['sha1']
+            else:
+                digest  = df_cache.path_hash(key)
+            sha.update(key.encode())
+            sha.update(digest.encode())
+        return sha.hexdigest()
@@ -2,10 +2,11 @@ from collections import OrderedDict
 import pandas as pd
 import numpy as np
 
-import tqdm
 
-from .data import clean_call
+from .data import clean_call, locate_calls
+from . import df_cache
 
+@df_cache.cached('pskreporter',version=1)
 def get_df(csv_file,qth_locator=None):
     """
     Reads a PSKReporter CSV generated by generate_seqp_csv() into a
@@ -55,9 +56,8 @@ def get_df(csv_file,qth_locator=None):
         # external sources. These do not include QRZ as their license does not permit my use. 
         #  - Philip Gladstone, 30 April 2018
 
-        tqdm.tqdm.pandas(tqdm.tqdm,leave=True)
-
         print('Geolocating PSKReporter dataframe...')
+        locs    = locate_calls(np.concatenate([df['call_0'].values,df['call_1'].values]),qth_locator)
         for key in [0,1]:
             grid_k      = 'grid_{!s}'.format(key)
             grid_src_k  = 'grid_src_{!s}'.format(key)
@@ -65,11 +65,8 @@ def get_df(csv_file,qth_locator=None):
 
             print('{} --> {}'.format(call_k,grid_k))
 
-            result              = df[call_k].progress_apply(qth_locator)
-            grids, grid_srcs    = zip(*result)
-
-            grids               = np.array(grids)           
-            grid_srcs           = np.array(grid_srcs)
+            grids               = df[call_k].map(locs['grid']).values
+            grid_srcs           = df[call_k].map(locs['grid_src']).values
 
             tf  = np.logical_not(np.logical_or( pd.isnull(grid_srcs),
                                                 grid_srcs=='qrz'    ))
@@ -0,0 +1,335 @@
+import time
+import random
+import asyncio
+import threading
+import configparser
+import urllib.request, urllib.error, urllib.parse
+import xml.etree.ElementTree as ET
+import concurrent.futures
+import http.server
+
+qrz_url = 'https://xmldata.qrz.com/xml/current/'
+
+# Seconds before a callsign that QRZ could not resolve is looked up again.
+negative_ttl    = 30*24*3600.
+
+class QrzNotFound(Exception):
+    pass
+
+class QrzSessionError(Exception):
+    pass
+
+class QrzLookupError(Exception):
+    pass
+
+def parse_qrz_xml(text):
+    """
+    Parse a QRZ XML response into (session, callsign) dictionaries.
+    Tag namespaces are stripped; callsign is None if the response has
+    no <Callsign> record.
+    """
+    root    = ET.fromstring(text)
+    session = {}
+    record  = None
+    for child in root:
+        tag = child.tag.split('}')[-1]
+        if tag == 'Session':
+            session = {x.tag.split('}')[-1]:x.text for x in child}
+        elif tag == 'Callsign':
+            record  = {x.tag.split('}')[-1]:x.text for x in child}
+    return session,record
+
+class TokenBucket(object):
+    def __init__(self,rate,burst=None):
+        """
+        Token bucket rate limiter for asyncio code.
+            rate:   tokens per second (None for no limit)
+            burst:  bucket size; defaults to max(1, rate)
+        """
+        self.rate       = rate
+        if rate is not None and burst is None:
+            burst       = max(1.,rate)
+        self.capacity   = burst
+        self.tokens     = burst
+        self.updated    = time.monotonic()
+
+    async def acquire(self):
+        if self.rate is None:
+            return
+
+        while True:
+            now             = time.monotonic()
+            self.tokens     = min(self.capacity,self.tokens + (now-self.updated)*self.rate)
+            self.updated    = now
+            if self.tokens >= 1.:
+                self.tokens -= 1.
+                return
+            await asyncio.sleep((1.-self.tokens)/self.rate)
+
+class QrzLookupEngine(object):
+    def __init__(self,username=None,password=None,cfg='./qrz_settings.cfg',url=qrz_url,
+            concurrency=8,rate=10.,burst=None,retries=3,backoff=0.5,timeout=10.,agent='seqp'):
+        """
+        Concurrent, rate-limited client for the QRZ.com XML callsign API.
+
+        Credentials are taken from username/password, or else from the [qrz]
+        section of cfg (the same file pyQRZ uses). Nothing is read or sent
+        until the first lookup.
+
+        concurrency:    maximum requests in flight
+        rate, burst:    token bucket limit in requests per second
+        retries:        retries for network errors, with exponential backoff
+                        starting at backoff seconds
+
+        resolve(calls) is the asyncio interface. lookup_many(calls) and
+        callsign(call) are synchronous wrappers; callsign() matches the
+        pyQRZ QRZ.callsign() call used in the rest of the package.
+        """
+        self.username       = username
+        self.password       = password
+        self.cfg            = cfg
+        self.url            = url
+        self.concurrency    = concurrency
+        self.rate           = rate
+        self.burst          = burst
+        self.retries        = retries
+        self.backoff        = backoff
+        self.timeout        = timeout
+        self.agent          = agent
+        self.session_key    = None
+
+    def __credentials(self):
+        if self.username is None:
+            config  = configparser.ConfigParser()
+            config.read(self.cfg)
+            self.username   = config.get('qrz','username')
+            self.password   = config.get('qrz','password')
+        return self.username,self.password
+
+    def __get(self,params):
+        """
+        Blocking HTTP GET of the API; run in the executor.
+        """
+        url = '{!s}?{!s}'.format(self.url,urllib.parse.urlencode(params))
+        with urllib.request.urlopen(url,timeout=self.timeout) as resp:
+            return resp.read()
+
+    async def __request(self,params):
+        """
+        GET with rate limiting and retry with exponential backoff.
+        """
+        loop    = asyncio.get_running_loop()
+        for attempt in range(self.retries+1):
+            await self.__bucket.acquire()
+            try:
+                return await loop.run_in_executor(self.__executor,self.__get,params)
+            except (urllib.error.URLError,OSError) as err:
+                if isinstance(err,urllib.error.HTTPError) and err.code < 500:
+                    raise
+                if attempt == self.retries:
+                    raise
+                delay   = self.backoff * 2**attempt
+                await asyncio.sleep(delay + random.uniform(0,delay))
+
+    async def __login(self,stale_key=None):
+        async with self.__login_lock:
+            # Another task may already have logged in again.
+            if self.session_key is not None and self.session_key != stale_key:
+                return self.session_key
+
+            username,password   = self.__credentials()
+            params      = {'username':username,'password':password,'agent':self.agent}
+            text        = await self.__request(params)
+            session,rec = parse_qrz_xml(text)
+            if session.get('Key') is None:
+                raise QrzSessionError(session.get('Error'))
+            self.session_key    = session['Key']
+            return self.session_key
+
+    async def __lookup(self,call):
+        async with self.__semaphore:
+            key = self.session_key
+            if key is None:
+                key = await self.__login()
+
+            # Allow one re-login if the session key has expired.
+            for attempt in range(2):
+                text        = await self.__request({'s':key,'callsign':call})
+                session,rec = parse_qrz_xml(text)
+                if rec is not None:
+                    return rec
+
+                error   = session.get('Error') or ''
+                if 'not found' in error.lower():
+                    return None
+                if session.get('Key') is None or 'session' in error.lower():
+                    key = await self.__login(stale_key=key)
+                    continue
+                raise QrzLookupError(error)
+            raise QrzLookupError('Session expired: {!s}'.format(call))
+
+    async def resolve(self,calls):
+        """
+        Look up many callsigns concurrently.
+        Returns a dictionary of callsign --> QRZ record (a dictionary of
+        the XML fields, e.g. 'lat', 'lon', 'grid'), or None for calls that
+        QRZ does not know. Calls whose lookup failed (network errors after
+        all retries) are left out, so callers can tell a failure from a
+        call that does not exist.
+        """
+        calls               = list(dict.fromkeys(calls))
+        self.__semaphore    = asyncio.Semaphore(self.concurrency)
+        self.__login_lock   = asyncio.Lock()
+        self.__bucket       = TokenBucket(self.rate,self.burst)
+
+        failed  = object()
+        async def safe_lookup(call):
+            try:
+                return await self.__lookup(call)
+            except QrzSessionError:
+                raise
+            except Exception:
+                return failed
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            self.__executor = executor
+            results         = await asyncio.gather(*[safe_lookup(call) for call in calls])
+        return {call:rec for call,rec in zip(calls,results) if rec is not failed}
+
+    def lookup_many(self,calls):
+        """
+        Synchronous wrapper around resolve(). Safe to call from a thread
+        that is already running an event loop (e.g. Jupyter).
+        """
+        return run_sync(self.resolve(calls))
+
+    def callsign(self,call):
+        """
+        Look up a single callsign. Raises QrzNotFound if there is no record
+        and QrzLookupError if the lookup failed.
+        """
+        results = self.lookup_many([call])
+        if call not in results:
+            raise QrzLookupError(call)
+        if results[call] is None:
+            raise QrzNotFound(call)
+        return results[call]
+
+def run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # A loop is already running in this thread; use a private one.
+    result  = {}
+    def target():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as err:
+            result['error'] = err
+    thread  = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+################################################################################
+class FakeQrzServer(object):
+    def __init__(self,records,username='test',password='test',latency=0.,host='127.0.0.1',port=0):
+        """
+        Local stand-in for the QRZ.com XML API, for offline tests and
+        throughput benchmarks.
+            records:    dictionary of callsign --> dictionary of fields
+            latency:    seconds to sleep before each response
+
+        Use as a context manager, or call start()/stop(). Point a
+        QrzLookupEngine at it with url=server.url.
+        """
+        self.records    = records
+        self.username   = username
+        self.password   = password
+        self.latency    = latency
+        self.keys       = set()
+        self.requests   = 0
+        self.__lock     = threading.Lock()
+
+        server          = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                query   = urllib.parse.urlparse(self.path).query
+                params  = dict(urllib.parse.parse_qsl(query))
+                body    = server.respond(params).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type','text/xml')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,*args):
+                pass
+
+        self.httpd      = http.server.ThreadingHTTPServer((host,port),Handler)
+        self.httpd.daemon_threads = True
+        self.url        = 'http://{!s}:{:d}/xml/current/'.format(*self.httpd.server_address)
+        self.__thread   = None
+
+    def respond(self,params):
+        with self.__lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if 'username' in params:
+            if params['username'] == self.username and params.get('password') == self.password:
+                key = '{:032x}'.format(random.getrandbits(128))
+                with self.__lock:
+                    self.keys.add(key)
+                return self.__xml(session='<Key>{!s}</Key>'.format(key))
+            return self.__xml(session='<Error>Username/password incorrect</Error>')
+
+        if params.get('s') not in self.keys:
+            return self.__xml(session='<Error>Session Timeout</Error>')
+
+        call    = params.get('callsign','').upper()
+        rec     = self.records.get(call)
+        if rec is None:
+            return self.__xml(session='<Key>{!s}</Key><Error>Not found: {!s}</Error>'.format(params['s'],call))
+
+        fields  = ''.join(['<{0}>{1}</{0}>'.format(k,v) for k,v in rec.items()])
+        return self.__xml(session='<Key>{!s}</Key>'.format(params['s']),
+                          callsign='<call>{!s}</call>{!s}'.format(call,fields))
+
+    def __xml(self,session='',callsign=None):
+        txt = []
+        txt.append('<?xml version="1.0" encoding="utf-8" ?>')
+        txt.append('<QRZDatabase version="1.34" xmlns="http://xmldata.qrz.com">')
+        if callsign is not None:
+            txt.append('<Callsign>{!s}</Callsign>'.format(callsign))
+        txt.append('<Session>{!s}</Session>'.format(session))
+        txt.append('</QRZDatabase>')
+        return '\n'.join(txt)
+
+    def expire_sessions(self):
+        """Invalidate all session keys, as QRZ does on timeout."""
+        with self.__lock:
+            self.keys.clear()
+
+    def start(self):
+        self.__thread   = threading.Thread(target=self.httpd.serve_forever,daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*args):
+        self.stop()
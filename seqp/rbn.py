@@ -1,22 +1,25 @@
 import os
 import datetime
 import zipfile
-import urllib.request, urllib.error, urllib.parse          # Used to automatically download data files from the web.
 
 from collections import OrderedDict
 import numpy as np
 import pandas as pd
-import tqdm
 
 import mysql.connector
 
-#from pyporktools import qrz
-from qrz import QRZ #sudo pip3 install pyQRZ
-qrz = QRZ(cfg='./qrz_settings.cfg')
-
-from .data import clean_call
+from .data import clean_call, locate_calls
+from . import df_cache
+from .location_cache import MySqlLocationCache
+from .qrz_async import QrzLookupEngine, negative_ttl
+from .tiered_cache import TieredCache
+from .rbn_download import RbnDownloader
+from .rbn_store import RbnStore
 from . import geopack
 
+# QRZ Username/Password must be stored in qrz_settings.cfg
+qrz = QrzLookupEngine(cfg='./qrz_settings.cfg')
+
 Re = 6371
 
 def rbn_csv_to_df(csv_file):
@@ -26,6 +29,7 @@ def rbn_csv_to_df(csv_file):
     df = pd.read_csv(csv_file,parse_dates=[0])
     return df
 
+@df_cache.cached('rbn',version=1)
 def get_df(csv_file,qth_locator=None):
     """
     Reads a RBN CSV into a pandas dataframe that has been
@@ -63,7 +67,7 @@ def get_df(csv_file,qth_locator=None):
 
     if qth_locator is not None:
         print('Geolocating RBN dataframe...')
-        tqdm.tqdm.pandas(tqdm.tqdm,leave=True)
+        locs    = locate_calls(np.concatenate([df['call_0'].values,df['call_1'].values]),qth_locator)
         for key in [0,1]:
             grid_k      = 'grid_{!s}'.format(key)
             grid_src_k  = 'grid_src_{!s}'.format(key)
@@ -71,11 +75,8 @@ def get_df(csv_file,qth_locator=None):
 
             print('{} --> {}'.format(call_k,grid_k))
 
-            result              = df[call_k].progress_apply(qth_locator)
-            grids, grid_srcs    = zip(*result)
-
-            df[grid_k]          = grids
-            df[grid_src_k]      = grid_srcs
+            df[grid_k]          = df[call_k].map(locs['grid'])
+            df[grid_src_k]      = df[call_k].map(locs['grid_src'])
 
     # Set Dataframe to MHz.
     df['frequency'] = df['frequency']/1000.
@@ -98,212 +99,326 @@ class MySqlEclipse(object):
                       lat FLOAT,
                       lon FLOAT,
                       lookup_source VARCHAR(20),
-                      lookup_datetime DATETIME
+                      lookup_datetime DATETIME,
+                      valid_from DATETIME,
+                      valid_to DATETIME
                       );
                       '''
         crsr.execute(qry)
+
+        # Validity intervals were added later; upgrade older tables.
+        for col in ['valid_from','valid_to']:
+            try:
+                crsr.execute('ALTER TABLE location_cache ADD COLUMN {!s} DATETIME NULL;'.format(col))
+            except mysql.connector.Error as err:
+                if err.errno != 1060:   # ER_DUP_FIELDNAME: column already exists
+                    raise
+
+        # Index callsign so cache lookups do not scan the table.
+        try:
+            crsr.execute('CREATE INDEX location_cache_callsign ON location_cache (callsign);')
+        except mysql.connector.Error as err:
+            if err.errno != 1061:   # ER_DUP_KEYNAME: index already exists
+                raise
         db.commit()
 
         self.db     = db
 
 mysql_ecl = MySqlEclipse()
 
-ram_cache   = {}
+# Pooled client used by geolocate() for batched location_cache lookups.
+location_cache  = MySqlLocationCache()
 
-def geolocate(callsign):
+# Callsign --> (lat, lon). RAM LRU in front of an on-disk tier that
+# survives restarts; both sit ahead of MySQL and QRZ.
+ram_cache   = TieredCache('rbn_location',maxsize=200000,negative_ttl=negative_ttl)
+
+# Number of QRZ lookups between cache checkpoints in geolocate_calls().
+qrz_batch_size  = 500
+
+def geolocate_calls(calls,errors=None):
     """
-    Get the latitude and longitude of a callsign.
-    First check the RAM cache, then the local MySQL cache, then go to QRZ.
-    If the result is missing from any of the caches, add it.
+    Resolve unique callsigns through the cache tiers in bulk: the
+    RAM/disk ram_cache, then one batched location_cache query for the
+    misses, then concurrent QRZ.com lookups for the rest. Calls QRZ cannot
+    resolve are cached as (nan, nan) for negative_ttl seconds.
+
+    QRZ lookups run in checkpoints of qrz_batch_size calls. Each batch is
+    written to the caches (one commit each) as soon as it completes, so
+    an interrupted run loses at most one batch and a re-run continues
+    from the cache.
+
+    Calls whose lookup failed with a network error are added to the set
+    errors, if given. They are returned as (nan, nan) but not cached, so
+    the next lookup of those calls goes to QRZ.com again.
+
+    Returns a dictionary of callsign --> (lat, lon).
     """
+    results = ram_cache.get_many(calls)
+    misses  = [call for call in calls if call not in results]
 
-    # Check the RAM cache first...
-    ram_result = ram_cache.get(callsign)
-    if ram_result is not None:
-        return ram_result
+    if len(misses) == 0:
+        return results
 
     # Now check MySQL...
-    user        = 'hamsci'
-    password    = 'hamsci'
-    host        = 'localhost'
-    database    = 'seqp_analysis'
-    db          = mysql.connector.connect(user=user,password=password,host=host,database=database)
-    
-    qry     = ("SELECT lat,lon FROM location_cache "
-               "WHERE callsign='{}';".format(callsign))
-    crsr    = db.cursor()
-    crsr.execute(qry)
-    result  = crsr.fetchone()
-    crsr.close()
-
-    if result is None:
-        # Not in RAM or MySQL, so try QRZ.com...
+    sql_results = location_cache.lookup_many(misses,negative_ttl=negative_ttl)
+    sql_failed  = {call:val for call,val in sql_results.items() if np.isnan(val[0])}
+    results.update(sql_results)
+    ram_cache.set_many([(call,val) for call,val in sql_results.items() if call not in sql_failed])
+    ram_cache.set_many(sql_failed,negative=True)
+    misses  = [call for call in misses if call not in sql_results]
+
+    if len(misses) == 0:
+        return results
+
+    # Not in RAM or MySQL, so try QRZ.com...
+    if len(misses) > 1:
+        print('Looking up {:d} calls on QRZ.com...'.format(len(misses)))
+    for inx in range(0,len(misses),qrz_batch_size):
+        batch   = misses[inx:inx+qrz_batch_size]
+        batch_errors = qrz_checkpoint(batch,results)
+        if errors is not None:
+            errors.update(batch_errors)
+        if len(misses) > qrz_batch_size:
+            print('QRZ.com checkpoint: {:d} of {:d} calls'.format(inx+len(batch),len(misses)))
+    return results
+
+def qrz_checkpoint(batch,results):
+    """
+    Look up one batch of calls on QRZ.com, store the answers in results
+    and flush them to ram_cache and location_cache.
+    Returns the set of calls whose lookup failed with an error. If QRZ
+    login fails (e.g. bad credentials), the whole batch is an error.
+    """
+    try:
+        qrz_results = qrz.lookup_many(batch)
+    except Exception as err:
+        print('QRZ.com lookup failed ({!r}); {:d} calls not resolved.'.format(err,len(batch)))
+        qrz_results = {}
+    new_rows    = []
+    failed      = {}
+    errors      = {}
+    for call in batch:
         try:
-            result  = qrz.callsign(callsign)
-            lat     = float(result['lat'])
-            lon     = float(result['lon'])
+            rec = qrz_results[call]
+            lat = float(rec['lat'])
+            lon = float(rec['lon'])
         except:
-            lat     = np.nan
-            lon     = np.nan
-
+            lat = np.nan
+            lon = np.nan
+        results[call]   = (lat,lon)
         if not np.isnan(lat):
-            # Add information to mysql database
-            add_mysql       = ("INSERT INTO location_cache "
-                               "(callsign,lat,lon,lookup_source,lookup_datetime) "
-                               "VALUES (%s, %s, %s, %s, %s);")
+            new_rows.append((call,lat,lon))
+        elif call in qrz_results:
+            failed[call]    = (lat,lon)
+        else:
+            errors[call]    = (lat,lon)
+
+    # Calls QRZ could not resolve are cached too, but expire after
+    # negative_ttl. Network errors are not cached, so they are retried.
+    ram_cache.set_many([(call,(lat,lon)) for call,lat,lon in new_rows])
+    ram_cache.set_many(failed,negative=True)
+    failed_rows = [(call,lat,lon) for call,(lat,lon) in failed.items()]
+    location_cache.insert_many(new_rows+failed_rows,lookup_source='qrz')
+    return set(errors.keys())
+
+def geolocate(callsign):
+    """
+    Get the latitude and longitude of a callsign.
+    First check the RAM cache, then the local MySQL cache, then go to QRZ.
+    If the result is missing from any of the caches, add it.
+    """
+    return geolocate_calls([callsign])[callsign]
 
-            lookup_source   = 'qrz'
-            lookup_datetime = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+def geolocate_many(calls,errors=None):
+    """
+    Geolocate many callsigns at once.
+    Each unique call is resolved once through the RAM cache, the MySQL
+    cache and QRZ (see geolocate_calls(), which also describes errors).
 
-            data_mysql      = (callsign,lat,lon,lookup_source,lookup_datetime)
+    Returns a dataframe indexed by callsign with columns lat and lon.
+    """
+    calls   = pd.unique(pd.Series(calls).dropna())
+    locs    = geolocate_calls(calls,errors=errors)
+    results = [locs[call] for call in calls]
 
-            crsr    = db.cursor()
-            crsr.execute(add_mysql,data_mysql)
-            db.commit()
-            crsr.close()
+    if len(results) == 0:
+        lats, lons  = [], []
     else:
-        lat = result[0]
-        lon = result[1]
-    db.close()
+        lats, lons  = zip(*results)
 
-    result              = (lat,lon)
-    ram_cache[callsign] = result
-    return result
+    locs    = pd.DataFrame({'lat':np.array(lats,dtype=float),'lon':np.array(lons,dtype=float)},index=calls)
+    return locs
 
-def read_rbn(sTime,eTime=None,data_dir='data/rbn',qrz_call=None,qrz_passwd=None):
-    ymd_list    = [datetime.datetime(sTime.year,sTime.month,sTime.day)]
-    eDay        =  datetime.datetime(eTime.year,eTime.month,eTime.day)
-    while ymd_list[-1] < eDay:
-        ymd_list.append(ymd_list[-1] + datetime.timedelta(days=1))
+def geolocate_at(calls,times,errors=None):
+    """
+    Geolocate each call at the matching time, e.g. the spots of a table.
 
-    for ymd_dt in ymd_list:
-        ymd         = ymd_dt.strftime('%Y%m%d')
-        data_file   = '{0}.zip'.format(ymd)
-        data_path   = os.path.join(data_dir,data_file)  
+    Every unique call is first resolved with geolocate_many(), which also
+    fills the caches from QRZ. All stored locations of those calls are then
+    loaded from location_cache as a LocationHistory in one query and
+    searched for the interval valid at each time, so portable stations and
+    calls that moved get the position they had then. Calls without a
+    matching interval keep their geolocate_many() location.
 
-        time_0      = datetime.datetime.now()
-        print('Starting RBN processing on <%s> at %s.' % (data_file,str(time_0)))
-
-        ################################################################################
-        # Make sure the data file exists.  If not, download it and open it.
-        if not os.path.exists(data_path):
-             try:    # Create the output directory, but fail silently if it already exists
-                 os.makedirs(data_dir) 
-             except:
-                 pass
-
-             # File downloading code from: http://stackoverflow.com/questions/22676/how-do-i-download-a-file-over-http-using-python
-             url = 'http://www.reversebeacon.net/raw_data/dl.php?f='+ymd
-
-             u = urllib.request.urlopen(url)
-             f = open(data_path, 'wb')
-             meta = u.info()
-             file_size = int(meta["Content-Length"])
-             print("Downloading: %s Bytes: %s" % (data_path, file_size))
-         
-             file_size_dl = 0
-             block_sz = 8192
-             while True:
-                 buffer = u.read(block_sz)
-                 if not buffer:
-                     break
-         
-                 file_size_dl += len(buffer)
-                 f.write(buffer)
-                 status = r"%10d  [%3.2f%%]" % (file_size_dl, file_size_dl * 100. / file_size)
-                 status = status + chr(8)*(len(status)+1)
-                 print(status, end=' ')
-             f.close()
-             status = 'Done downloading!  Now converting to Pandas dataframe...'
-             print(status)
-
-        std_sTime=datetime.datetime(sTime.year,sTime.month,sTime.day, sTime.hour)
-        if eTime.minute == 0 and eTime.second == 0:
-            hourly_eTime=datetime.datetime(eTime.year,eTime.month,eTime.day, eTime.hour)
-        else:
-            hourly_eTime=eTime+datetime.timedelta(hours=1)
-            hourly_eTime=datetime.datetime(hourly_eTime.year,hourly_eTime.month,hourly_eTime.day, hourly_eTime.hour)
-
-        std_eTime=std_sTime+datetime.timedelta(hours=1)
-
-        hour_flag=0
-        while std_eTime<=hourly_eTime:
-                csv_filename = 'rbn_'+std_sTime.strftime('%Y%m%d%H%M-')+std_eTime.strftime('%Y%m%d%H%M.csv.bz2')
-
-                csv_filepath = os.path.join(data_dir,csv_filename)
-                print(csv_filepath)
-                if not os.path.exists(csv_filepath):
-                    # Load data into dataframe here. ###############################################
-                    with zipfile.ZipFile(data_path,'r') as z:   #This block lets us directly read the compressed gz file into memory.
-                        with z.open(ymd+'.csv') as fl:
-                            df          = pd.read_csv(fl,parse_dates=[10])
-
-                    # Create columns for storing geolocation data.
-                    df['dx_lat'] = np.zeros(df.shape[0],dtype=np.float)*np.nan
-                    df['dx_lon'] = np.zeros(df.shape[0],dtype=np.float)*np.nan
-                    df['de_lat'] = np.zeros(df.shape[0],dtype=np.float)*np.nan
-                    df['de_lon'] = np.zeros(df.shape[0],dtype=np.float)*np.nan
-
-                    # Trim dataframe to just the entries in a 1 hour time period.
-                    df = df[np.logical_and(df['date'] >= std_sTime,df['date'] < std_eTime)]
-
-                    # Look up lat/lons in QRZ.com
-                    errors  = 0
-                    success = 0
-                    for index,row in df.iterrows():
-                        if index % 50   == 0:
-                            print(index,datetime.datetime.now()-time_0,row['date'])
-                        de_call = row['callsign']
-                        dx_call = row['dx']
-                        dts     = row['date'].strftime('%Y %b %d %H%M UT')
-
-                        de      = geolocate(de_call)
-                        dx      = geolocate(dx_call)
-                        row['de_lat'] = de[0]
-                        row['de_lon'] = de[1]
-                        row['dx_lat'] = dx[0]
-                        row['dx_lon'] = dx[1]
-                        df.loc[index] = row
-
-                        if np.isnan(de[0]) or np.isnan(dx[0]):
-#                            print('{index:06d} LOOKUP ERROR - {dt} DX: {dx} DE: {de}'.format(index=index,dt=dts,dx=dx_call,de=de_call))
-                            errors += 1
-                        else:
-#                            print('{index:06d} OK - {dt} DX: {dx} DE: {de}'.format(index=index,dt=dts,dx=dx_call,de=de_call))
-                            success += 1
-
-                    total   = success + errors
-                    if total == 0:
-                        print("No call signs geolocated.")
-                    else:
-                        pct     = success / float(total) * 100.
-                        print('{0:d} of {1:d} ({2:.1f} %) call signs geolocated via qrz.com.'.format(success,total,pct))
-                    print('Writing: {}'.format(csv_filepath))
-                    df.to_csv(csv_filepath,index=False,compression='bz2')
-                else:
-                    print('Reading: {}'.format(csv_filepath))
-                    df = pd.read_csv(csv_filepath,parse_dates=['date'],compression='bz2')
-
-                if hour_flag==0:
-                    df_comp=df
-                    hour_flag=hour_flag+1
-                #When specified start/end times cross over the hour mark
-                else:
-                    df_comp=pd.concat([df_comp, df])
-
-                std_sTime=std_eTime
-                std_eTime=std_sTime+datetime.timedelta(hours=1)
-        
-        # Trim dataframe to just the entries we need.
-        df = df_comp[np.logical_and(df_comp['date'] >= sTime,df_comp['date'] < eTime)]
-
-        # Calculate Total Great Circle Path Distance
-        lat1, lon1          = df['de_lat'],df['de_lon']
-        lat2, lon2          = df['dx_lat'],df['dx_lon']
-        R_gc                = Re*geopack.greatCircleDist(lat1,lon1,lat2,lon2)
-        df.loc[:,'R_gc']    = R_gc
-
-        # Calculate Band
-        df.loc[:,'band']        = np.array((np.floor(df['freq']/1000.)),dtype=np.int)
+    Returns (lat, lon) arrays.
+    """
+    calls   = np.asarray(calls,dtype=object)
+    locs    = geolocate_many(calls,errors=errors)
+    lats    = pd.Series(calls).map(locs['lat']).values.astype(float)
+    lons    = pd.Series(calls).map(locs['lon']).values.astype(float)
+
+    history = location_cache.history_many(locs.index)
+    h_lats,h_lons   = history.locate(calls,times)
+    tf      = np.isfinite(h_lats)
+    lats[tf]    = h_lats[tf]
+    lons[tf]    = h_lons[tf]
+    return lats,lons
+
+def download_rbn_day(ymd_dt,data_dir='data/rbn'):
+    """
+    Make sure the RBN archive for a day exists in data_dir, downloading it
+    from reversebeacon.net if needed. Returns the path to the zip file.
+    """
+    return RbnDownloader(data_dir).download_day(ymd_dt)
+
+def read_rbn_day(ymd_dt,data_dir='data/rbn'):
+    """
+    Parse a full day of RBN spots from its daily zip archive.
+    """
+    ymd         = ymd_dt.strftime('%Y%m%d')
+    data_path   = download_rbn_day(ymd_dt,data_dir)
+
+    # Load data into dataframe here. ###############################################
+    print('Parsing: {}'.format(data_path))
+    with zipfile.ZipFile(data_path,'r') as z:   #This block lets us directly read the compressed gz file into memory.
+        with z.open(ymd+'.csv') as fl:
+            df          = pd.read_csv(fl,parse_dates=[10])
+    return df
+
+def rbn_hour_path(hour,data_dir='data/rbn'):
+    """
+    Path to the legacy geolocated csv.bz2 file for the hour starting at hour.
+    Superseded by RbnStore; kept so old caches can be imported.
+    """
+    hour_eTime      = hour + datetime.timedelta(hours=1)
+    csv_filename    = 'rbn_'+hour.strftime('%Y%m%d%H%M-')+hour_eTime.strftime('%Y%m%d%H%M.csv.bz2')
+    return os.path.join(data_dir,csv_filename)
 
+def geolocate_rbn_df(df,time_0=None,errors=None):
+    """
+    Fill in de_lat/de_lon/dx_lat/dx_lon for a dataframe of RBN spots.
+    The unique callsign and dx calls are resolved together with
+    geolocate_at() at the time of each spot. Calls that could not be
+    looked up because of errors are added to the set errors.
+    """
+    if time_0 is None:
+        time_0  = datetime.datetime.now()
+
+    df      = df.copy()
+    calls   = np.concatenate([df['callsign'].values,df['dx'].values])
+    times   = np.concatenate([df['date'].values,df['date'].values])
+    lats,lons   = geolocate_at(calls,times,errors=errors)
+
+    nn      = len(df)
+    df['dx_lat'] = lats[nn:]
+    df['dx_lon'] = lons[nn:]
+    df['de_lat'] = lats[:nn]
+    df['de_lon'] = lons[:nn]
+
+    tf      = np.logical_and(np.isfinite(df['de_lat'].values),np.isfinite(df['dx_lat'].values))
+    success = int(np.count_nonzero(tf))
+    total   = len(df)
+    if total == 0:
+        print("No call signs geolocated.")
+    else:
+        pct     = success / float(total) * 100.
+        print('{0:d} of {1:d} ({2:.1f} %) call signs geolocated via qrz.com.'.format(success,total,pct))
+    print('Geolocation time: {!s}'.format(datetime.datetime.now()-time_0))
+    return df
+
+def read_rbn(sTime,eTime=None,data_dir='data/rbn',qrz_call=None,qrz_passwd=None):
+    """
+    Load geolocated RBN spots between sTime and eTime.
+
+    Spots are kept in an RbnStore in data_dir, one columnar partition per
+    hour. Hours that are not stored yet are built from the daily archive,
+    which is parsed only once per day and split into all of its missing
+    hours in a single pass. Hours still in the old csv.bz2 cache are
+    imported instead of rebuilt. The range may span several days.
+
+    Each hour is written as soon as it is geolocated, and QRZ results are
+    checkpointed to the location caches in batches (see geolocate_calls()).
+    Hours with failed lookups are recorded as incomplete partitions.
+    Re-running after a crash or QRZ outage continues from there.
+    """
+    # List every hour that overlaps [sTime, eTime).
+    std_sTime   = datetime.datetime(sTime.year,sTime.month,sTime.day, sTime.hour)
+    hours       = [std_sTime]
+    while hours[-1] + datetime.timedelta(hours=1) < eTime:
+        hours.append(hours[-1] + datetime.timedelta(hours=1))
+
+    store       = RbnStore(data_dir)
+    for hour in hours:
+        csv_filepath = rbn_hour_path(hour,data_dir)
+        if not store.has(hour) and os.path.exists(csv_filepath):
+            print('Importing: {}'.format(csv_filepath))
+            store.import_bz2(csv_filepath)
+
+    # Group the hours that still need building by UT day.
+    day_hours   = OrderedDict()
+    for hour in hours:
+        if store.has(hour):
+            continue
+        ymd_dt  = datetime.datetime(hour.year,hour.month,hour.day)
+        day_hours.setdefault(ymd_dt,[]).append(hour)
+
+    # Fetch the archives of all days that still need building concurrently.
+    if len(day_hours) > 0:
+        downloader  = RbnDownloader(data_dir)
+        downloader.download_days(list(day_hours.keys()))
+
+    for ymd_dt,hrs in day_hours.items():
+        time_0      = datetime.datetime.now()
+        print('Starting RBN processing on <{}> at {}.'.format(ymd_dt.strftime('%Y%m%d'),str(time_0)))
+
+        day_df      = read_rbn_day(ymd_dt,data_dir)
+        hr_keys     = pd.to_datetime(day_df['date'].values.astype('datetime64[h]'))
+        hr_groups   = day_df.groupby(hr_keys)
+
+        for hour in hrs:
+            # Trim dataframe to just the entries in a 1 hour time period.
+            # Only the hours being built are materialized.
+            if pd.Timestamp(hour) in hr_groups.groups:
+                df  = hr_groups.get_group(pd.Timestamp(hour))
+            else:
+                df  = day_df.iloc[:0]
+            df  = df.reset_index(drop=True)
+            errors  = set()
+            df  = geolocate_rbn_df(df,time_0,errors=errors)
+
+            # An hour with failed lookups is stored but marked incomplete,
+            # so the next run rebuilds it; calls resolved so far come
+            # straight from the cache.
+            complete    = len(errors) == 0
+            extra       = None if complete else {'unresolved':len(errors)}
+            if not complete:
+                print('{:d} calls could not be looked up; hour marked incomplete.'.format(len(errors)))
+            print('Writing: {}'.format(store.write(hour,df,complete=complete,extra=extra)))
+
+    # Only the partitions overlapping [sTime, eTime) are opened.
+    df = store.read(sTime,eTime)
+    if len(df) == 0 and 'de_lat' not in df.columns:
+        print('No RBN spots stored between {!s} and {!s}.'.format(sTime,eTime))
         return df
+
+    # Calculate Total Great Circle Path Distance
+    lat1, lon1          = df['de_lat'],df['de_lon']
+    lat2, lon2          = df['dx_lat'],df['dx_lon']
+    R_gc                = Re*geopack.greatCircleDist(lat1,lon1,lat2,lon2)
+    df['R_gc']          = R_gc
+
+    # Calculate Band
+    df['band']          = np.floor(df['freq']/1000.).astype(int)
+
+    return df
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import hashlib
+import datetime
+import zipfile
+import threading
+import http.client
+import concurrent.futures
+import urllib.request, urllib.error, urllib.parse
+
+from . import gen_lib
+
+rbn_url = 'http://www.reversebeacon.net/raw_data/dl.php?f={ymd}'
+
+class RbnDownloader(object):
+    def __init__(self,data_dir='data/rbn',url=rbn_url,workers=4,retries=3,
+            block_sz=2**20,timeout=60.):
+        """
+        Download manager for the daily RBN archives (YYYYMMDD.zip).
+
+        Days are fetched concurrently into YYYYMMDD.zip.part files. An
+        interrupted download is resumed with an HTTP Range request. A
+        finished file is checked with zipfile.testzip() before it is
+        renamed into place and recorded in data_dir/rbn_manifest.json, so
+        a partial or corrupt zip is never mistaken for a complete day.
+
+        url is a template with a {ymd} field; point it at a local server
+        for testing.
+        """
+        self.data_dir   = data_dir
+        self.url        = url
+        self.workers    = workers
+        self.retries    = retries
+        self.block_sz   = block_sz
+        self.timeout    = timeout
+        self.manifest_path  = os.path.join(data_dir,'rbn_manifest.json')
+        self.__lock     = threading.Lock()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path,'r') as fl:
+            return json.load(fl)
+
+    def __record(self,ymd,entry):
+        with self.__lock:
+            manifest        = self.load_manifest()
+            manifest[ymd]   = entry
+            gen_lib.atomic_json_dump(manifest,self.manifest_path,indent=1,sort_keys=True)
+
+    def __verify(self,path,ymd):
+        """
+        True if path is a readable zip holding YYYYMMDD.csv.
+        """
+        try:
+            with zipfile.ZipFile(path,'r') as z:
+                if ymd+'.csv' not in z.namelist():
+                    return False
+                return z.testzip() is None
+        except (zipfile.BadZipFile,OSError):
+            return False
+
+    def __entry(self,path):
+        sha = hashlib.sha1()
+        with open(path,'rb') as fl:
+            for buf in iter(lambda: fl.read(self.block_sz),b''):
+                sha.update(buf)
+        entry   = {}
+        entry['size']       = os.path.getsize(path)
+        entry['sha1']       = sha.hexdigest()
+        entry['completed']  = datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        return entry
+
+    def is_complete(self,ymd_dt,manifest=None):
+        """
+        True if the day's zip is on disk and matches its manifest entry.
+        """
+        ymd     = ymd_dt.strftime('%Y%m%d')
+        path    = os.path.join(self.data_dir,'{0}.zip'.format(ymd))
+        if manifest is None:
+            manifest    = self.load_manifest()
+        entry   = manifest.get(ymd)
+        return (entry is not None and os.path.exists(path)
+                and os.path.getsize(path) == entry['size'])
+
+    def __fetch(self,url,part_path):
+        """
+        Fetch url into part_path, resuming from its current size.
+        Raises http.client.IncompleteRead if the connection ends before
+        the size announced by the server, leaving the part to be resumed.
+        """
+        offset  = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        req     = urllib.request.Request(url)
+        if offset > 0:
+            req.add_header('Range','bytes={:d}-'.format(offset))
+
+        try:
+            resp    = urllib.request.urlopen(req,timeout=self.timeout)
+        except urllib.error.HTTPError as err:
+            if err.code == 416:
+                # Requested range not satisfiable: the part file is already complete.
+                return
+            raise
+
+        with resp:
+            # 206 means the server honored the Range; anything else restarts.
+            if resp.status == 206:
+                mode    = 'ab'
+                start   = offset
+            else:
+                mode    = 'wb'
+                start   = 0
+
+            # Total size of the file: from Content-Range when resuming,
+            # otherwise from Content-Length. None if the server does not say.
+            total   = None
+            c_range = resp.headers.get('Content-Range')
+            c_len   = resp.headers.get('Content-Length')
+            if c_range is not None and '/' in c_range and not c_range.endswith('/*'):
+                total   = int(c_range.rsplit('/',1)[1])
+            elif c_len is not None:
+                total   = start + int(c_len)
+
+            with open(part_path,mode) as fl:
+                while True:
+                    buf = resp.read(self.block_sz)
+                    if not buf:
+                        break
+                    fl.write(buf)
+
+        size    = os.path.getsize(part_path)
+        if total is not None and size < total:
+            raise http.client.IncompleteRead(b'',total-size)
+
+    def download_day(self,ymd_dt):
+        """
+        Make sure the archive for one day is on disk and verified.
+        Returns the path to the zip file.
+        """
+        ymd         = ymd_dt.strftime('%Y%m%d')
+        path        = os.path.join(self.data_dir,'{0}.zip'.format(ymd))
+        part_path   = path + '.part'
+
+        if self.is_complete(ymd_dt):
+            return path
+
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        # A zip from before the manifest existed is kept only if it verifies.
+        if os.path.exists(path):
+            if self.__verify(path,ymd):
+                self.__record(ymd,self.__entry(path))
+                return path
+            print('Removing corrupt RBN archive: {}'.format(path))
+            os.remove(path)
+
+        url = self.url.format(ymd=ymd)
+        for attempt in range(self.retries+1):
+            try:
+                self.__fetch(url,part_path)
+            except (urllib.error.URLError,http.client.HTTPException,OSError) as err:
+                if attempt == self.retries:
+                    raise
+                # Keep the part; the next attempt resumes it with a Range request.
+                print('Retrying {} ({!r})'.format(url,err))
+                time.sleep(2**attempt)
+                continue
+
+            if self.__verify(part_path,ymd):
+                os.replace(part_path,path)
+                self.__record(ymd,self.__entry(path))
+                print('Downloaded: {} ({:d} bytes)'.format(path,os.path.getsize(path)))
+                return path
+
+            # Full length but unreadable; start over.
+            os.remove(part_path)
+            if attempt == self.retries:
+                raise Exception('Could not download a valid archive: {}'.format(url))
+
+    def download_days(self,days):
+        """
+        Download a list of days concurrently.
+        Returns a list of zip paths in the same order.
+        """
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            paths   = list(executor.map(self.download_day,days))
+        return paths
+
+    def download_range(self,sTime,eTime):
+        """
+        Download every day from sTime through eTime concurrently.
+        Returns a list of zip paths in date order.
+        """
+        days    = [datetime.datetime(sTime.year,sTime.month,sTime.day)]
+        eDay    =  datetime.datetime(eTime.year,eTime.month,eTime.day)
+        while days[-1] < eDay:
+            days.append(days[-1] + datetime.timedelta(days=1))
+        return self.download_days(days)
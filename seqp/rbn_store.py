@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import glob
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from . import df_cache
+from . import gen_lib
+
+class RbnStore(object):
+    def __init__(self,data_dir='data/rbn',row_group_size=20000):
+        """
+        Time-partitioned columnar store of geolocated RBN spots.
+
+        Each UT hour is one file in data_dir/rbn_store, sorted by date and
+        holding typed columns: Parquet when pyarrow is installed, otherwise
+        a pickle. data_dir/rbn_store/manifest.json lists every partition
+        with its time range, row count and data range. Queries open only
+        the partitions that overlap the requested interval. Parquet
+        partitions are filtered on date with row-group pushdown; pickles
+        are sliced with a binary search.
+        """
+        self.data_dir       = data_dir
+        self.store_dir      = os.path.join(data_dir,'rbn_store')
+        self.manifest_path  = os.path.join(self.store_dir,'manifest.json')
+        self.row_group_size = row_group_size
+        self.fmt            = df_cache.cache_fmt
+        self.manifest       = self.load_manifest()
+
+    @staticmethod
+    def key(hour):
+        return hour.strftime('%Y%m%d%H')
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path,'r') as fl:
+            return json.load(fl)
+
+    def save_manifest(self):
+        gen_lib.atomic_json_dump(self.manifest,self.manifest_path,indent=1,sort_keys=True)
+
+    def has(self,hour):
+        """True if the partition for the hour starting at hour is complete."""
+        entry   = self.manifest.get(self.key(hour))
+        return entry is not None and entry.get('complete',True)
+
+    def write(self,hour,df,complete=True,extra=None):
+        """
+        Write the spots for the hour starting at hour as one partition and
+        record it in the manifest. extra is merged into the manifest entry.
+        """
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+
+        df      = df.sort_values('date',kind='mergesort').reset_index(drop=True)
+        key     = self.key(hour)
+        fname   = 'rbn_{!s}.{!s}'.format(key,self.fmt)
+        path    = os.path.join(self.store_dir,fname)
+        tmp     = path + '.tmp'
+        if self.fmt == 'parquet':
+            df.to_parquet(tmp,index=False,row_group_size=self.row_group_size)
+        else:
+            df.to_pickle(tmp)
+        os.replace(tmp,path)
+
+        entry   = {}
+        entry['file']       = fname
+        entry['start']      = hour.strftime('%Y-%m-%d %H:%M:%S')
+        entry['end']        = (hour+datetime.timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+        entry['rows']       = int(len(df))
+        entry['complete']   = complete
+        if len(df) > 0:
+            entry['tmin']   = str(df['date'].iloc[0])
+            entry['tmax']   = str(df['date'].iloc[-1])
+        if extra is not None:
+            entry.update(extra)
+
+        self.manifest[key]  = entry
+        self.save_manifest()
+        return path
+
+    def read_partition(self,key,sTime=None,eTime=None):
+        """
+        Read one partition, keeping rows with sTime <= date < eTime.
+        """
+        path    = os.path.join(self.store_dir,self.manifest[key]['file'])
+        if path.endswith('.parquet'):
+            filters = []
+            if sTime is not None:
+                filters.append(('date','>=',pd.Timestamp(sTime)))
+            if eTime is not None:
+                filters.append(('date','<',pd.Timestamp(eTime)))
+            return pd.read_parquet(path,filters=filters if filters else None)
+
+        df      = pd.read_pickle(path)
+        dates   = df['date'].values
+        inx_0   = 0 if sTime is None else np.searchsorted(dates,np.datetime64(sTime),side='left')
+        inx_1   = len(df) if eTime is None else np.searchsorted(dates,np.datetime64(eTime),side='left')
+        return df.iloc[inx_0:inx_1]
+
+    def read(self,sTime,eTime):
+        """
+        Read all stored spots with sTime <= date < eTime.
+        Only partitions whose time range overlaps the interval are opened.
+        If none do, the result is an empty frame with the columns and
+        dtypes of a stored partition (no columns if the store is empty).
+        """
+        df_lst  = []
+        for key in sorted(self.manifest.keys()):
+            entry   = self.manifest[key]
+            start   = datetime.datetime.strptime(entry['start'],'%Y-%m-%d %H:%M:%S')
+            end     = datetime.datetime.strptime(entry['end'],'%Y-%m-%d %H:%M:%S')
+            if end <= sTime or start >= eTime:
+                continue
+
+            # Only filter partitions that are cut by the interval.
+            s_filt  = sTime if sTime > start else None
+            e_filt  = eTime if eTime < end else None
+            df_lst.append(self.read_partition(key,s_filt,e_filt))
+
+        if len(df_lst) == 0:
+            keys    = sorted(self.manifest.keys())
+            if len(keys) == 0:
+                return pd.DataFrame()
+            return self.read_partition(keys[0]).iloc[:0].reset_index(drop=True)
+        return pd.concat(df_lst,ignore_index=True)
+
+    def import_bz2(self,csv_filepath):
+        """
+        Copy one hourly rbn_YYYYmmddHHMM-YYYYmmddHHMM.csv.bz2 cache file
+        into the store. Returns the hour imported.
+        """
+        fname   = os.path.basename(csv_filepath)
+        match   = re.match(r'rbn_(\d{12})-(\d{12})\.csv\.bz2$',fname)
+        if match is None:
+            raise Exception('Not an hourly RBN cache file: {!s}'.format(csv_filepath))
+
+        hour    = datetime.datetime.strptime(match.group(1),'%Y%m%d%H%M')
+        df      = pd.read_csv(csv_filepath,parse_dates=['date'],compression='bz2')
+        self.write(hour,df,extra={'imported':fname})
+        return hour
+
+def migrate_bz2_cache(data_dir='data/rbn',remove=False):
+    """
+    One-time migration of the hourly csv.bz2 cache in data_dir into an
+    RbnStore. Hours already in the store are skipped. With remove=True
+    the bz2 files are deleted once imported.
+    """
+    store   = RbnStore(data_dir)
+    files   = sorted(glob.glob(os.path.join(data_dir,'rbn_*-*.csv.bz2')))
+    print('Migrating {:d} hourly RBN files into {!s}...'.format(len(files),store.store_dir))
+    for csv_filepath in files:
+        stamp   = os.path.basename(csv_filepath)[4:16]
+        hour    = datetime.datetime.strptime(stamp,'%Y%m%d%H%M')
+        if not store.has(hour):
+            print('Importing: {}'.format(csv_filepath))
+            store.import_bz2(csv_filepath)
+        if remove:
+            os.remove(csv_filepath)
+    return store
@@ -1,41 +1,383 @@
 import os,glob
+import re
+import json
 import datetime
+import hashlib
 import dateutil
-import logging
+import multiprocessing as mp
 from collections import OrderedDict
 
 import mysql.connector
 
 import numpy as np
 import pandas as pd
-import tqdm
-
-# QRZ Username/Password must be stored in qrz_settings.cfg
-from qrz import QRZ
-qrz = QRZ(cfg='./qrz_settings.cfg')
 
 #from hamtools import qrz
 
 from .data import clean_call
+from . import df_cache
 from . import gen_lib
 prep_output = gen_lib.prep_output
 from . import locator
 grid_valid  = locator.grid_valid
+from .qrz_async import QrzLookupEngine, negative_ttl
+from .tiered_cache import TieredCache
+from .log_manifest import LogManifest
+
+# QRZ Username/Password must be stored in qrz_settings.cfg
+qrz = QrzLookupEngine(cfg='./qrz_settings.cfg')
+
+# Callsign --> QRZ grid, persisted across runs. None records a call QRZ
+# does not know.
+qrz_grid_cache  = TieredCache('qrz_grid',negative_ttl=negative_ttl)
+
+def qrz_grids(calls):
+    """
+    Grid squares of many callsigns from QRZ.com in one concurrent batch.
+    Returns a dictionary of call --> grid, with None for calls QRZ has no
+    record (or no grid) for. Calls whose lookup failed are left out and
+    not cached.
+    Results, including misses, are kept in qrz_grid_cache.
+    """
+    calls   = list(dict.fromkeys(calls))
+    result  = qrz_grid_cache.get_many(calls)
+    misses  = [call for call in calls if call not in result]
+    if len(misses) == 0:
+        return result
+
+    print('Looking up {:d} calls on QRZ.com...'.format(len(misses)))
+    try:
+        recs    = qrz.lookup_many(misses)
+    except Exception:
+        # Login failed; treat every call as a failed lookup.
+        recs    = {}
+
+    found       = {}
+    not_found   = {}
+    for call,rec in recs.items():
+        if rec is None or rec.get('grid') is None:
+            not_found[call] = None
+        else:
+            found[call]     = rec['grid']
+
+    qrz_grid_cache.set_many(found)
+    qrz_grid_cache.set_many(not_found,negative=True)
+    result.update(found)
+    result.update(not_found)
+    return result
+
+# Format version of SeqpQTH.save(); bump when the saved layout changes.
+qth_save_version    = 2
+
+def save_string_columns(path,columns):
+    """
+    Save string columns (dictionary of name --> array, None allowed) as
+    int32 codes in name.npy into one shared vocabulary of UTF-8 byte
+    strings in vocab.npy. Null values get code -1.
+    """
+    values  = [np.asarray(x,dtype=object) for x in columns.values()]
+    allv    = np.concatenate(values) if len(values) > 0 else np.array([],dtype=object)
+    vocab   = pd.unique(allv[~pd.isnull(allv)])
+    v_inx   = pd.Index(vocab,dtype=object)
+    for name,vals in zip(columns.keys(),values):
+        codes   = v_inx.get_indexer(vals)
+        np.save(os.path.join(path,name+'.npy'),codes.astype(np.int32))
+
+    vocab   = np.char.encode(np.array(vocab,dtype=str),'utf-8') if len(vocab) > 0 else np.array([],dtype='S1')
+    np.save(os.path.join(path,'vocab.npy'),vocab)
+
+def load_string_columns(path,names):
+    """
+    Load columns written by save_string_columns() as object arrays.
+    The vocabulary is decoded once; each column is one take() of the
+    memory-mapped codes.
+    """
+    vocab   = np.load(os.path.join(path,'vocab.npy'))
+    vocab   = np.concatenate([[None],np.char.decode(vocab,'utf-8').astype(object)])
+    columns = OrderedDict()
+    for name in names:
+        codes           = np.load(os.path.join(path,name+'.npy'),mmap_mode='r')
+        columns[name]   = np.take(vocab,codes.astype(np.int64)+1)
+    return columns
+
+def log_signature(log_dir):
+    """
+    Content signature of the logs in log_dir, or None if log_dir is None.
+    """
+    if log_dir is None:
+        return None
+    manifest    = LogManifest('seqp_logs',version=log_parser_version)
+    return manifest.signature(find_log_files(log_dir))
 
-class LogFilter(object):
-    def __init__(self,level):
+def submissions_signature(user='hamsci', password='hamsci', host='localhost', database='hamsci_rsrch'):
+    """
+    SHA1 of the (callsign, per_gs) rows of the seqp_submissions table.
+    """
+    cnx     = mysql.connector.connect(user=user, password=password,host=host, database=database)
+    crsr    = cnx.cursor()
+    crsr.execute("SELECT callsign,per_gs FROM seqp_submissions")
+    rows    = sorted('{!s}\t{!s}'.format(*row) for row in crsr)
+    crsr.close()
+    cnx.close()
+    return hashlib.sha1('\n'.join(rows).encode()).hexdigest()
+
+class SeqpReport(object):
+    def __init__(self,output_dir=None,bufsize=2**20):
         """
-        Convenience class to send different log levels to
-        different output files.
+        Run-scoped writer for the seqp_logs_to_df() report files in
+        output_dir:
+            qso_raw.txt:    every QSO line, as a sanity check
+            seqp_info.log:  logs that were processed
+            seqp_error.log: parse errors
+        Each file is opened once with a large buffer and closed by close()
+        or at the end of a with block. Nothing is written when output_dir
+        is None.
         """
-        self.__level = level
+        self.files  = OrderedDict()
+        if output_dir is None:
+            return
+
+        fnames  = OrderedDict()
+        fnames['raw']   = 'qso_raw.txt'
+        fnames['info']  = 'seqp_info.log'
+        fnames['error'] = 'seqp_error.log'
+        for key,fname in fnames.items():
+            self.files[key] = open(os.path.join(output_dir,fname),'w',buffering=bufsize)
+
+    def write(self,key,lines):
+        fl  = self.files.get(key)
+        if fl is None:
+            return
+        for line in lines:
+            fl.write(line+'\n')
+
+    def add(self,result):
+        """Report the output of one parse_seqp_log() call."""
+        self.write('raw',result['qso_lines'])
+        self.write('error',result['errors'])
+        if result['parsed']:
+            self.write('info',['Processed: {!s}'.format(result['log_file'])])
+
+    def close(self):
+        for fl in self.files.values():
+            fl.close()
+        self.files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+# Version of the per-log parse results cached in the LogManifest; bump it
+# whenever parse_seqp_log() output changes.
+log_parser_version  = 2
+
+# Columns of the dataframe returned by seqp_logs_to_df().
+log_columns = ['freq','mode','datetime','call_0','rst_0','grid_0',
+               'call_1','rst_1','grid_1','power','single_op','log_file']
+
+# Exchange fields of a QSO line after the date and time, in order.
+qso_slots   = [('call_0','call'),('rst_0','sig_rpt'),('grid_0','grid'),
+               ('call_1','call'),('rst_1','sig_rpt'),('grid_1','grid')]
+qso_slot_types  = [fcheck for key,fcheck in qso_slots]
+
+def find_log_files(log_dir):
+    """
+    List the *.log files in log_dir and one directory level below it.
+    """
+    # Need to descend a level for calls with /suffixes.
+    dirs    = [os.path.join(log_dir,x) for x in next(os.walk(log_dir))[1]]
+    dirs    = [log_dir] + dirs
+
+    files   = []
+    for dr in dirs:
+        tmp     = glob.glob(os.path.join(dr,'*.log'))
+        files   = files + tmp
+    return files
+
+def read_log_lines(fle):
+    """
+    Read a log file once and decode it as UTF-8, falling back to
+    ISO-8859-1. Returns the cleaned lines.
+    """
+    with open(fle,'rb') as fl:
+        data    = fl.read()
+
+    for encoding in ['utf-8','ISO-8859-1']:
+        try:
+            text    = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+
+    rpl_strs = [u'\xa0',u'\u00FF',"\\'a0",'\\']
+    for rpl_str in rpl_strs:
+        text    = text.replace(rpl_str, u' ')
+    text    = text.replace(u'\xad', u'-')
+    return text.splitlines()
+
+# One pass over the exchange fields of a QSO line. Each whitespace-separated
+# token matches exactly one group, in the same precedence as field_check()
+# applied after db_check(): a number with a dB suffix (db_check() strips
+# every trailing d/b), a signal report (anything float() accepts), a grid
+# (two letters, two digits), a call (3 or more characters), or a short
+# token that fits no field.
+number_re   = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|[+-]?(?:[nN][aA][nN]|[iI][nN][fF](?:[iI][nN][iI][tT][yY])?)'
+token_re    = re.compile(r'''(?<!\S)(?:
+                (?P<db>{0})[bBdD]*[dD][bB] |
+                (?P<sig_rpt>{0})        |
+                (?P<grid>[^\W\d_]{{2}}\d{{2}}\S*) |
+                (?P<call>\S{{3,}})       |
+                (?P<short>\S{{1,2}})
+                )(?!\S)'''.format(number_re),re.VERBOSE)
+
+date_re     = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+time_re     = re.compile(r'(\d{2})(\d{2})$')
+
+def parse_qso_datetime(date_str):
+    """
+    Parse the date and time fields of a QSO line. The standard
+    YYYY-MM-DD HHMM form is decoded directly; anything else goes through
+    dateutil. Raises ValueError if the fields cannot be parsed.
+    """
+    if len(date_str) == 2:
+        dm  = date_re.match(date_str[0])
+        tm  = time_re.match(date_str[1])
+        if dm is not None and tm is not None:
+            try:
+                return datetime.datetime(int(dm.group(1)),int(dm.group(2)),int(dm.group(3)),
+                                         int(tm.group(1)),int(tm.group(2)))
+            except ValueError:
+                pass
+    return dateutil.parser.parse(' '.join(date_str))
+
+def parse_qso(qso_str,soapbox,single_op,fle):
+    """
+    Parse the text of a QSO line after 'QSO:' into a tuple of
+    log_columns values. Returns (values, error) where error is None or a
+    message about an unreadable date.
+
+    The exchange fields are classified in one regex pass (token_re) and
+    fill the qso_slots in order; a slot that does not match the type of
+    the next field is left empty.
+    """
+    qso     = qso_str.split(None,4)
+    error   = None
+    freq    = freq_check(qso[0])
+    mode    = qso[1].upper()
+
+    date_str    = qso[2:4]
+    try:
+        dt  = parse_qso_datetime(date_str)
+    except:
+        dt      = np.datetime64('NaT')
+        error   = 'QSO DateParse Error: {!s} ({!s})'.format(fle,date_str)
+
+    slots   = [None]*len(qso_slots)
+    slot    = 0
+    rest    = qso[4] if len(qso) > 4 else ''
+    for match in token_re.finditer(rest):
+        ftype   = match.lastgroup
+        if ftype == 'db':
+            ftype   = 'sig_rpt'
+            val     = str(float(match.group('db')))
+        else:
+            val     = match.group(ftype)
 
-    def filter(self,logRecord):
-        return logRecord.levelno == self.__level
+        while slot < len(qso_slots):
+            fcheck  = qso_slot_types[slot]
+            slot   += 1
+            if ftype == fcheck:
+                slots[slot-1]   = val.upper()
+                break
+
+    values  = (freq,mode,dt) + tuple(slots) + (soapbox.get('POWER'),single_op,os.path.basename(fle))
+    return values,error
 
-def seqp_logs_to_df(log_dir='data/seqp/submitted_logs',output_dir=None):
+def parse_seqp_log(fle):
+    """
+    Parse one Cabrillo log file. This is a pure function of the file so
+    that logs can be parsed in a process pool.
+
+    Returns a dictionary with:
+        log_file:   path of the log
+        df:         dataframe of the QSOs (log_columns)
+        qso_lines:  raw QSO lines, for the qso_raw.txt sanity check
+        errors:     list of error messages
+        parsed:     False if parsing stopped on an error; QSOs read
+                    before the error are still returned
+    """
+    print('Processing {!s}...'.format(fle))
+    rows        = []
+    qso_lines   = []
+    errors      = []
+    parsed      = True
+
+    raw         = read_log_lines(fle)
+    try: 
+        single_op   = True
+        soapbox     = {}
+        for line in raw:
+            spl = line.split(':')
+            key = spl[0].upper()
+
+            if key == 'CATEGORY-OPERATOR':
+                if 'MULTI' in spl[1]:
+                    single_op = False
+
+            if key == 'OPERATORS':
+                operators = len(spl[1].split())
+                if operators > 1:
+                    single_op = False
+
+            # Parse Soapbox
+            if key == 'SOAPBOX':
+                tmp = spl[1].split(',')
+                for val in tmp:
+                    try:
+                        sb_line = val.split('=')
+                        soapbox[sb_line[0].upper().strip()] = sb_line[1].strip()
+                    except:
+                        pass
+
+            # Parse QSO Line
+            if key == 'QSO':
+                # Write all QSOs to a text file as a sanity check.
+                qso_lines.append(line)
+
+                values,error    = parse_qso(spl[1],soapbox,single_op,fle)
+                if error is not None:
+                    errors.append(error)
+                rows.append(values)
+    except Exception as ex:
+        errors.append('Parsing error: {!s}'.format(fle))
+        parsed  = False
+
+    result  = OrderedDict()
+    result['log_file']  = fle
+    cols    = OrderedDict([(col,[]) for col in log_columns])
+    for col,vals in zip(log_columns,zip(*rows)):
+        cols[col]   = list(vals)
+    result['df']        = pd.DataFrame(cols,columns=log_columns)
+    result['qso_lines'] = qso_lines
+    result['errors']    = errors
+    result['parsed']    = parsed
+    return result
+
+def seqp_logs_to_df(log_dir='data/seqp/submitted_logs',output_dir=None,processes=None,
+        return_errors=False,use_manifest=True):
     """
     Load SEQP Logs into a Data Frame.
+
+    Each log is parsed by parse_seqp_log() in a process pool of processes
+    workers (default: one per CPU) and the per-file chunks are concatenated
+    once. With return_errors=True, returns (df, errors) where errors is an
+    OrderedDict of log file --> list of error messages.
+
+    Parse results are cached per file in a LogManifest (keyed on path,
+    size, mtime and content hash), so a re-run only parses logs that are
+    new or changed. Use use_manifest=False to parse everything.
     """
     # START-OF-LOG: 2.0
     # ARRL-SECTION: KS
@@ -65,148 +407,63 @@ def seqp_logs_to_df(log_dir='data/seqp/submitted_logs',output_dir=None):
     # QSO: 14029 CW 2017-08-21 1803 NJ0P          579  W7IY          559  FM18GP
     # QSO: 14019 CW 2017-08-21 1812 NJ0P          599  K1EO          599  FN44NS
     # END-OF-LOG:
-    ### Create log files for call signs properly parsed and not.
-    log         = logging.getLogger()
-
-    if output_dir is not None:
-        handler_1   = logging.FileHandler(os.path.join(output_dir,'seqp_info.log'),mode='w')
-        handler_1.setLevel(logging.INFO)
-        handler_1.addFilter(LogFilter(logging.INFO))
-        log.addHandler(handler_1)
-
-        handler_2   = logging.FileHandler(os.path.join(output_dir,'seqp_error.log'),mode='w')
-        handler_2.setLevel(logging.ERROR)
-        handler_2.addFilter(LogFilter(logging.ERROR))
-        log.addHandler(handler_2)
-
-    log.setLevel(logging.INFO)
-
     ### Find Log Files ###
-    # Need to descend a level for calls with /suffixes.
-    dirs    = [os.path.join(log_dir,x) for x in next(os.walk(log_dir))[1]]
-    dirs    = [log_dir] + dirs
-
-    files   = []
-    for dr in dirs:
-        tmp     = glob.glob(os.path.join(dr,'*.log'))
-        files   = files + tmp
-
-    # Write all QSOs to a text file as a sanity check.
-    if output_dir is not None:
-        raw_out_path    = os.path.join(output_dir,'qso_raw.txt')
-        with open(raw_out_path,'w') as fl:
-            pass
-
-    df_lst  = []
-    for fle in files:
-        print('Processing {!s}...'.format(fle))
-        for encoding in ['utf-8','ISO-8859-1']:
-            try:
-                with open(fle,'U',encoding=encoding) as fl:
-                    raw = fl.read().splitlines()
-
-                rpl_strs = [u'\xa0',u'\u00FF',"\\'a0",'\\']
-                for rpl_str in rpl_strs:
-                    raw = [x.replace(rpl_str, u' ') for x in raw]
+    files   = find_log_files(log_dir)
+
+    # Reuse the results of logs that have not changed since the last run.
+    results = OrderedDict([(fle,None) for fle in files])
+    if use_manifest:
+        manifest    = LogManifest('seqp_logs',version=log_parser_version)
+        for fle in files:
+            results[fle]    = manifest.lookup(fle)
+    todo    = [fle for fle,result in results.items() if result is None]
+    print('Parsing {:d} of {:d} SEQP logs ({:d} unchanged).'.format(len(todo),len(files),len(files)-len(todo)))
+
+    if processes is None:
+        processes   = mp.cpu_count()
+
+    if processes <= 1 or len(todo) <= 1:
+        parsed  = map(parse_seqp_log,todo)
+        pool    = None
+    else:
+        pool    = mp.Pool(processes)
+        parsed  = pool.imap(parse_seqp_log,todo,chunksize=max(1,len(todo)//(4*processes)))
 
-                raw = [x.replace(u'\xad', u'-') for x in raw]
+    try:
+        for result in parsed:
+            results[result['log_file']] = result
+            if use_manifest:
+                manifest.store(result['log_file'],result)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if use_manifest:
+            manifest.prune(files,log_dir)
+            manifest.save()
+
+    results = list(results.values())
+    errors  = OrderedDict()
+    with SeqpReport(output_dir) as report:
+        for result in results:
+            report.add(result)
+            if len(result['errors']) > 0:
+                errors[result['log_file']]  = result['errors']
+
+    if len(errors) > 0:
+        print('{:d} of {:d} logs had parse errors.'.format(len(errors),len(files)))
+
+    df_lst  = [result['df'] for result in results]
+    if len(df_lst) == 0:
+        df  = pd.DataFrame(columns=log_columns)
+    else:
+        df  = pd.concat(df_lst,ignore_index=True)
 
-                encoding_error = False
-                break
-            except UnicodeDecodeError:
-                encoding_error = True
-                continue
-
-            if encoding_error:
-                logging.error('UnicodeDecodeError ({!s}): {!s}'.format(encoding,fle))
-
-        try: 
-            callsign            = None
-            single_op           = True
-            for line in raw:
-                spl = line.split(':')
-
-                if spl[0].upper() == 'QSO':
-                    # Write all QSOs to a text file as a sanity check.
-                    if output_dir is not None:
-                        with open(raw_out_path,'a') as fl:
-                            fl.write(line+'\n')
-
-                if spl[0].upper() == 'CATEGORY-OPERATOR':
-                    if 'MULTI' in spl[1]:
-                        single_op = False
-
-                if spl[0].upper() == 'OPERATORS':
-                    operators = len(spl[1].split())
-                    if operators > 1:
-                        single_op = False
-
-                # Parse Soapbox
-                soapbox = {}
-                if spl[0].upper() == 'SOAPBOX':
-                    tmp = spl[1].split(',')
-                    for val in tmp:
-                        try:
-                            sb_line = val.split('=')
-                            soapbox[sb_line[0].upper().strip()] = sb_line[1].strip()
-                        except:
-                            pass
-
-                # Parse QSO Line
-                if spl[0].upper() == 'QSO':
-                    qso                 = spl[1].split()
-                    qso_dct             = {}
-                    qso_dct['freq']     = freq_check(qso[0])
-                    qso_dct['mode']     = qso[1].upper()
-
-                    date_str            = qso[2:4]
-                    try:
-                        qso_dct['datetime'] = dateutil.parser.parse(' '.join(date_str))
-                    except:
-                        qso_dct['datetime'] = np.datetime64('NaT')
-                        logging.error('QSO DateParse Error: {!s} ({!s})'.format(fle,date_str))
-
-                    for val in qso[4:]:
-                        val = db_check(val)
-
-                        key_list = []
-                        key_list.append(('call_0','call'))
-                        key_list.append(('rst_0', 'sig_rpt'))
-                        key_list.append(('grid_0','grid'))
-                        key_list.append(('call_1','call'))
-                        key_list.append(('rst_1', 'sig_rpt'))
-                        key_list.append(('grid_1','grid'))
-
-                        next_val    = False
-                        for key,fcheck in key_list:
-                            if not key in qso_dct and not next_val:
-                                if field_check(val) == fcheck:
-                                    qso_dct[key]    = val.upper()
-                                    next_val = True
-                                else:
-                                    if key == 'grid_sent':
-                                        qso_dct[key]    = soapbox.get('GRID')
-                                    else:
-                                        qso_dct[key]    = None
-
-                        qso_dct['power']                = soapbox.get('POWER')
-                        qso_dct['single_op']            = single_op
-                        qso_dct['log_file']             = os.path.basename(fle)
-
-#                    qso_dct['call_sent']      = qso[4].upper()
-#                    qso_dct['rst_sent']     = qso[5]
-#                    qso_dct['grid_sent']    = qso[6].upper()
-#                    qso_dct['call_rx']      = qso[7].upper()
-#                    qso_dct['rst_rx']       = qso[8]
-#                    qso_dct['grid_rx']      = qso[9].upper()
-                    df_lst.append(qso_dct)
-            logging.info('Processed: {!s}'.format(fle))
-        except Exception as ex:
-            logging.error('Parsing error: {!s}'.format(fle))
-
-    df  = pd.DataFrame(df_lst)
     for key in ['call_0','call_1']:
         df[key] = df[key].apply(clean_call)
+
+    if return_errors:
+        return df,errors
     return df
 
 # SEQP Geolocation Code ########################################################
@@ -313,6 +570,19 @@ class GetGrid(object):
 
         return
 
+    @classmethod
+    def from_values(cls,call,source,grid=None,grid_count=None):
+        """
+        Build a GetGrid from an already resolved grid, without scanning
+        a qth_dct.
+        """
+        obj             = cls.__new__(cls)
+        obj.call        = call
+        obj.source      = source
+        obj.grid        = grid
+        obj.grid_count  = grid_count
+        return obj
+
     def __str__(self):
         return '{!s} {!s} {!s} {!s}'.format(self.call,self.grid,self.source,self.grid_count)
 
@@ -329,169 +599,376 @@ class SeqpQTH(object):
             df  = seqp_logs_to_df(log_dir,output_dir)
 
         self.log_df     = df
+        self.log_dir    = log_dir
         self.qrz_lookup = qrz_lookup
         self.__create_qth_dict(df)
         self.__update_from_sql()
         self.__qth_count()
         self.__create_qth_df()
-        self.__cache_dict   = {}
+        self.resolved   = pd.DataFrame({'grid':[],'grid_src':[],'count':[],'qrz_checked':[]},
+                                       index=pd.Index([],dtype=object),dtype=object)
 
     def __call__(self,call):
-        result  = self.__cache_dict.get(call)
-        if result is not None:
-            return result
-
-        gg_obj  = self.find_qth(call)
+        return self.locate_many([call])[0]
 
-        grid    = gg_obj.grid
-        grd_src = gg_obj.source
-
-        if grid is None and self.qrz_lookup:
-            try:
-                qz_obj  = qrz.callsign(call)
-                grid    = qz_obj['grid']
-                grd_src = 'qrz'
-            except:
-                pass
-
-        if grid is None:
-            grd_src = None
+    def locate_many(self,calls):
+        """
+        Resolve many calls at once (see resolve_all()).
+        Returns a list of (grid, grid_src) in the order of calls.
+        """
+        locs    = self.resolve_all(calls)
+        return list(zip(locs['grid'].values,locs['grid_src'].values))
 
-        result  = (grid,grd_src)
-        self.__cache_dict[call] = result
-        return result
+    def resolve_all(self,calls=None,qrz_lookup=None):
+        """
+        Resolve calls to their best grid in one batch.
+            calls:      array-like of callsigns; defaults to every call in
+                        the logs and the QTH table.
+            qrz_lookup: look calls the logs cannot place up on QRZ.com in
+                        one concurrent batch; defaults to self.qrz_lookup.
+
+        Results accumulate in self.resolved, a dataframe indexed by call
+        with columns grid, grid_src ('seqp_submitted', 'seqp_sent',
+        'seqp_rx', 'qrz' or None), count (number of reports of the grid)
+        and qrz_checked.
+
+        Returns the rows of self.resolved for calls, in order, with None
+        for missing values.
+        """
+        if qrz_lookup is None:
+            qrz_lookup  = self.qrz_lookup
+
+        if calls is None:
+            calls   = np.concatenate([self.log_df['call_0'].values,self.log_df['call_1'].values,
+                                      self.qth_df.index.values])
+        calls   = pd.Series(np.asarray(calls,dtype=object))
+        unq     = pd.unique(calls.dropna())
+
+        # Resolve new calls from the QTH table.
+        new     = unq[~pd.Index(unq).isin(self.resolved.index)]
+        if len(new) > 0:
+            keys    = pd.Series(new).str.upper().values
+            table   = self.qth_df.reindex(keys)
+            has     = table['grid'].notna().values
+            rows    = pd.DataFrame(index=pd.Index(new,dtype=object))
+            rows['grid']        = np.where(has,table['grid'].values,None)
+            rows['grid_src']    = np.where(has,table['source'].values,None)
+            rows['count']       = np.where(has,table['count'].values,None)
+            rows['qrz_checked'] = False
+            self.resolved   = pd.concat([self.resolved,rows.astype(object)])
+
+        # Fall back to QRZ for calls the logs do not place.
+        if qrz_lookup:
+            res     = self.resolved.loc[unq]
+            tf      = np.logical_and(res['grid'].isna().values,~res['qrz_checked'].values.astype(bool))
+            todo    = list(res.index[tf])
+            if len(todo) > 0:
+                grids   = qrz_grids(todo)
+                # Failed lookups are not in grids and are retried next time.
+                if len(grids) > 0:
+                    self.resolved.loc[list(grids.keys()),'qrz_checked'] = True
+                for call,grid in grids.items():
+                    if grid is not None:
+                        self.resolved.loc[call,['grid','grid_src']] = [grid,'qrz']
+
+        locs    = self.resolved.reindex(calls.values)
+        return locs.astype(object).where(locs.notna(),None)
+
+    @property
+    def cache_key(self):
+        """
+        Content hash of the QTH table, used to key dataframes geolocated
+        with this object in the df_cache.
+        None when qrz_lookup is on: QRZ.com answers (and transient lookup
+        failures) are not part of the table, so such results are not
+        cached.
+        """
+        if self.qrz_lookup:
+            return None
+        hsh = pd.util.hash_pandas_object(self.qth_df.astype(str),index=True).values
+        sha = hashlib.sha1(hsh.tobytes())
+        return 'SeqpQTH-{!s}'.format(sha.hexdigest())
 
     def __create_qth_dict(self,df):
         """
-        Put the call and grid from each QSO into a dictionary.
+        Melt the call and grid of each side of each QSO into a long table
+        of (call, source, grid) reports.
         """
-        qth_dct = {}
-        print('Building QTH Dictionary...')
-        for inx,row in tqdm.tqdm(df.iterrows(),total=len(df)):
-            sfxs     = [('sent',0),('rx',1)]
-            for sfx in sfxs:
-                try:
-                    call    = row['call_{!s}'.format(sfx[1])].upper()
-                    grid    = row['grid_{!s}'.format(sfx[1])].upper()
-
-                    if call not in qth_dct:
-                        qth_dct[call] = {}
-
-                    if 'seqp_'+sfx[0] not in qth_dct[call]:
-                        qth_dct[call]['seqp_'+sfx[0]] = []
-
-                    qth_dct[call]['seqp_'+sfx[0]].append(grid)
-                except:
-                    pass
-
-        self.qth_dict = qth_dct
+        print('Building QTH table...')
+        parts   = []
+        for sfx,key in [('sent',0),('rx',1)]:
+            part    = pd.DataFrame({'call':df['call_{!s}'.format(key)].values,
+                                    'grid':df['grid_{!s}'.format(key)].values})
+            part['source']  = 'seqp_'+sfx
+            parts.append(part)
+        self.__add_reports(parts)
+
+    def __add_reports(self,parts):
+        """
+        Append (call, grid, source) report frames to the long table,
+        keeping only rows where both call and grid are strings.
+        """
+        if hasattr(self,'qth_reports'):
+            parts   = [self.qth_reports] + parts
+        reports = pd.concat(parts,ignore_index=True)
+
+        is_str  = lambda x: isinstance(x,str)
+        tf      = np.logical_and(reports['call'].map(is_str).values.astype(bool),
+                                 reports['grid'].map(is_str).values.astype(bool))
+        reports = reports[tf].copy()
+        reports['call'] = reports['call'].str.upper()
+        reports['grid'] = reports['grid'].str.upper()
+        self.qth_reports    = reports[['call','source','grid']].reset_index(drop=True)
 
     def __update_from_sql(self,user='hamsci', password='hamsci', host='localhost', database='hamsci_rsrch'):
         """
-        Update qth_dict with values from submitted to hamsci.org.
+        Add the grids submitted to hamsci.org to the report table.
         """
         cnx     = mysql.connector.connect(user=user, password=password,host=host, database=database)
         crsr    = cnx.cursor()
         query   = ("SELECT callsign,per_gs FROM seqp_submissions")
         crsr.execute(query)
-
-        sfx     = 'seqp_submitted'
-        for callsign, per_gs in crsr:
-            try:
-                call    = callsign.upper()
-                grid    = per_gs.upper()
-
-                if call not in self.qth_dict:
-                    self.qth_dict[call] = {}
-
-                if sfx not in self.qth_dict[call]:
-                    self.qth_dict[call][sfx] = []
-
-                self.qth_dict[call][sfx].append(grid)
-            except:
-                pass
+        rows    = list(crsr)
         crsr.close()
         cnx.close()
 
+        part            = pd.DataFrame(rows,columns=['call','grid'],dtype=object)
+        part['source']  = 'seqp_submitted'
+        self.__add_reports([part])
+
     def __qth_count(self):
         """
-        Count the frequency of grids used in an array.
-        This method modifies self.qth_dict.
+        Count the reports of each (call, source, grid) with one groupby and
+        rank them: most frequent first, ties in reverse alphabetical order.
+        Sets self.qth_counts and self.qth_dict, which maps
+        call --> source --> [(grid, count), ...] in rank order.
         """
-        qth_cnt = {}
-        print('Counting QTHs in dictionary...')
-        for call,dct_0 in tqdm.tqdm(self.qth_dict.items()):
-            if call not in qth_cnt: qth_cnt[call] = {}
-            for srx, grids in dct_0.items():
-                if srx not in qth_cnt[call]:
-                    qth_cnt[call][srx] = {}
-                this_dct    = qth_cnt[call][srx]
-
-                grids_unq   = list(set(grids))
-                grids_unq.sort()
-
-                for grid in grids_unq:
-                    cnt             = np.count_nonzero(np.array(grids) == grid)
-                    this_dct[grid]  = cnt 
-
-                td_sorted = (sorted(this_dct.items(), key=lambda x:x[1]))[::-1]
-                qth_cnt[call][srx] = td_sorted
-
-        self.qth_dict   = qth_cnt
+        print('Counting QTHs...')
+        counts  = self.qth_reports.groupby(['call','source','grid']).size()
+        counts  = counts.rename('count').reset_index()
+        counts  = counts.sort_values(['call','source','count','grid'],
+                                     ascending=[True,True,False,False],kind='mergesort')
+        counts  = counts.reset_index(drop=True)
+
+        # Validate each distinct grid once.
+        grids   = pd.unique(counts['grid'])
+        if len(grids) > 0:
+            valid   = pd.Series(grid_valid(np.array(grids,dtype=object)).astype(bool),index=grids)
+        else:
+            valid   = pd.Series([],dtype=bool)
+        counts['valid']     = counts['grid'].map(valid).values.astype(bool)
+        counts['grid_len']  = counts['grid'].str.len()
+        self.__set_qth_counts(counts)
 
     def __create_qth_df(self):
         """
-        Creates a QTH dataframe from the QTH dictionary.
+        Creates a QTH dataframe with the best grid of every call.
+
+        Per source, the best grid is the highest ranked valid 6-character
+        grid, or else the highest ranked valid 4-character grid. Across
+        sources, seqp_submitted wins over seqp_sent, which wins over seqp_rx
+        (the same choice as GetGrid() and the original find_qth()).
         """
-        inx_lst     = []
-        qth_df_lst  = []
-        calls       = list(self.qth_dict.keys())
-        calls.sort()
-        for call in calls: 
-            grid_obj    = self.find_qth(call)
-
-            inx_lst.append(call)
-            tmp             = {}
-            tmp['grid']     = grid_obj.grid
-            tmp['count']    = grid_obj.grid_count
-            tmp['source']   = grid_obj.source
-
-            qth_df_lst.append(tmp)
-
-        qth_df              = pd.DataFrame(qth_df_lst,index=inx_lst)
-        qth_df['grid_len']  = qth_df.grid.apply(lambda x: 0 if x is None else len(x))
-        self.qth_df         = qth_df
+        counts  = self.qth_counts
+        tf      = np.logical_and(counts['valid'].values,counts['grid_len'].isin([4,6]).values)
+        cands   = counts[tf].copy()
+        cands['rank']   = np.arange(len(cands))
+
+        src_pri = {'seqp_submitted':0,'seqp_sent':1,'seqp_rx':2}
+        cands['src_pri']    = cands['source'].map(src_pri).values
+        cands   = cands[cands['src_pri'].notna().values]
+        cands   = cands.sort_values(['call','src_pri','grid_len','rank'],
+                                    ascending=[True,True,False,True],kind='mergesort')
+        best    = cands.drop_duplicates('call').set_index('call')
+
+        calls   = sorted(self.qth_dict.keys())
+        qth_df  = pd.DataFrame(index=calls)
+        qth_df['grid']      = best['grid'].reindex(calls).astype(object)
+        qth_df['count']     = best['count'].reindex(calls).astype(float)
+        qth_df['source']    = best['source'].reindex(calls).astype(object)
+
+        # Calls without a usable grid report the last source tried.
+        missing = qth_df['grid'].isna().values
+        qth_df.loc[missing,'grid']      = None
+        qth_df.loc[missing,'source']    = 'seqp_rx'
+        qth_df['grid_len']  = qth_df['grid'].map(lambda x: 0 if x is None else len(x))
+
+        self.__set_qth_df(qth_df)
         return qth_df
 
+    def __set_qth_df(self,qth_df):
+        self.qth_df         = qth_df
+        self.__qth_lookup   = dict(zip(qth_df.index,zip(qth_df['grid'].values,
+                                   qth_df['count'].values,qth_df['source'].values)))
+
+    def __set_qth_counts(self,counts):
+        self.qth_counts = counts
+        qth_cnt = {}
+        for call,source,grid,cnt in zip(counts['call'].values,counts['source'].values,
+                                        counts['grid'].values,counts['count'].values):
+            qth_cnt.setdefault(call,{}).setdefault(source,[]).append((grid,int(cnt)))
+        self.qth_dict   = qth_cnt
+
     def find_qth(self,call):
         """
         Determine the most appropriate QTH in the self.qth_dict for
-        for a particular call.
+        for a particular call. Reads the precomputed qth_df.
         """
-        submitted   = GetGrid(call,'seqp_submitted',self.qth_dict)
-        sent        = GetGrid(call,'seqp_sent',self.qth_dict)
-        rx          = GetGrid(call,'seqp_rx',self.qth_dict)
+        try:
+            key = call.upper()
+        except AttributeError:
+            return GetGrid.from_values(call,'seqp_rx')
 
-        ret = None
+        result  = self.__qth_lookup.get(key)
+        if result is None:
+            return GetGrid.from_values(call,'seqp_rx')
 
-        if submitted and sent and rx:
-            if submitted == sent:
-                ret = submitted
-            elif sent == rx:
-                ret = sent
-            else:
-                ret = submitted
+        grid,cnt,source = result
+        if grid is None:
+            return GetGrid.from_values(key,source)
+        return GetGrid.from_values(key,source,grid,int(cnt))
 
-        elif submitted: 
-            ret = submitted
+    def state(self):
+        """
+        Fingerprint of the inputs this object was built from: the content
+        signatures of the logs in log_dir (if known) and of the
+        seqp_submissions table.
+        """
+        state   = OrderedDict()
+        state['log_dir']        = self.log_dir
+        state['log_signature']  = log_signature(self.log_dir)
+        state['submissions']    = submissions_signature()
+        return state
 
-        elif sent:
-            ret = sent
+    def save(self,path):
+        """
+        Save qth_counts (from which qth_dict is rebuilt), qth_df, the
+        resolved table and the log dataframe to the directory path.
+
+        Numbers are stored as .npy arrays and strings as int32 codes into
+        one shared vocabulary, so load() maps the arrays and decodes each
+        string once instead of unpickling objects. The log dataframe is
+        written as Parquet when pyarrow is available. meta.json records
+        state() for the staleness check in load().
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        counts  = self.qth_counts
+        qth_df  = self.qth_df
+        res     = self.resolved
+
+        strings = OrderedDict()
+        for col in ['call','source','grid']:
+            strings['counts_'+col]  = counts[col].values
+        strings['qth_call']         = qth_df.index.values
+        strings['qth_grid']         = qth_df['grid'].values
+        strings['qth_source']       = qth_df['source'].values
+        strings['res_call']         = res.index.values
+        strings['res_grid']         = res['grid'].values
+        strings['res_grid_src']     = res['grid_src'].values
+        save_string_columns(path,strings)
+
+        np.save(os.path.join(path,'counts_count.npy'),counts['count'].values.astype(np.int32))
+        np.save(os.path.join(path,'counts_valid.npy'),counts['valid'].values.astype(bool))
+        np.save(os.path.join(path,'qth_count.npy'),qth_df['count'].values.astype(float))
+        np.save(os.path.join(path,'res_count.npy'),pd.to_numeric(res['count']).values.astype(float))
+        np.save(os.path.join(path,'res_qrz_checked.npy'),res['qrz_checked'].values.astype(bool))
+
+        for fname in ['log_df.parquet','log_df.pickle']:
+            if os.path.exists(os.path.join(path,fname)):
+                os.remove(os.path.join(path,fname))
+        saved   = False
+        if df_cache.cache_fmt == 'parquet':
+            try:
+                self.log_df.to_parquet(os.path.join(path,'log_df.parquet'))
+                saved   = True
+            except Exception:
+                # Columns Parquet cannot represent; fall back to a pickle.
+                if os.path.exists(os.path.join(path,'log_df.parquet')):
+                    os.remove(os.path.join(path,'log_df.parquet'))
+        if not saved:
+            self.log_df.to_pickle(os.path.join(path,'log_df.pickle'))
+
+        meta    = self.state()
+        meta['version']     = qth_save_version
+        meta['qrz_lookup']  = self.qrz_lookup
+        meta['saved']       = datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        gen_lib.atomic_json_dump(meta,os.path.join(path,'meta.json'),indent=1)
+        print('Saved SeqpQTH to {!s}'.format(path))
+        return path
+
+    @classmethod
+    def load(cls,path,log_dir=None,check=True,rebuild=True):
+        """
+        Load a SeqpQTH written by save().
 
+        With check=True the saved state is compared with the current logs
+        (in log_dir, default: the saved log_dir) and the seqp_submissions
+        table. If they differ (or nothing is saved at path) the object
+        is rebuilt from the logs and saved again when rebuild=True;
+        otherwise an exception is raised.
+        """
+        meta_path   = os.path.join(path,'meta.json')
+        meta        = None
+        if os.path.exists(meta_path):
+            with open(meta_path,'r') as fl:
+                meta    = json.load(fl)
+            if meta.get('version') != qth_save_version:
+                meta    = None
+
+        if log_dir is None and meta is not None:
+            log_dir = meta['log_dir']
+
+        stale   = meta is None
+        if not stale and check:
+            stale   = (meta['log_dir'] != log_dir
+                       or meta['log_signature'] != log_signature(log_dir)
+                       or meta['submissions'] != submissions_signature())
+
+        if stale:
+            if not rebuild or log_dir is None:
+                raise Exception('Saved SeqpQTH is missing or stale: {!s}'.format(path))
+            print('Rebuilding stale SeqpQTH: {!s}'.format(path))
+            qrz_lookup  = True if meta is None else meta['qrz_lookup']
+            obj         = cls(log_dir=log_dir,qrz_lookup=qrz_lookup)
+            obj.save(path)
+            return obj
+
+        obj             = cls.__new__(cls)
+        obj.log_dir     = meta['log_dir']
+        obj.qrz_lookup  = meta['qrz_lookup']
+        if os.path.exists(os.path.join(path,'log_df.parquet')):
+            obj.log_df  = pd.read_parquet(os.path.join(path,'log_df.parquet'))
         else:
-            ret = rx
-
-        return ret
+            obj.log_df  = pd.read_pickle(os.path.join(path,'log_df.pickle'))
+
+        names   = ['counts_call','counts_source','counts_grid','qth_call','qth_grid',
+                   'qth_source','res_call','res_grid','res_grid_src']
+        strings = load_string_columns(path,names)
+
+        counts  = pd.DataFrame(OrderedDict([(col,strings['counts_'+col]) for col in ['call','source','grid']]))
+        counts['count']     = np.load(os.path.join(path,'counts_count.npy'),mmap_mode='r')
+        counts['valid']     = np.load(os.path.join(path,'counts_valid.npy'),mmap_mode='r')
+        counts['grid_len']  = counts['grid'].str.len()
+        obj.__set_qth_counts(counts)
+
+        qth_df  = pd.DataFrame(index=strings['qth_call'])
+        qth_df['grid']      = strings['qth_grid']
+        qth_df['count']     = np.load(os.path.join(path,'qth_count.npy'),mmap_mode='r')
+        qth_df['source']    = strings['qth_source']
+        qth_df['grid_len']  = qth_df['grid'].str.len().fillna(0).astype(int)
+        obj.__set_qth_df(qth_df)
+
+        count   = np.load(os.path.join(path,'res_count.npy'),mmap_mode='r')
+        res     = pd.DataFrame(index=pd.Index(strings['res_call'],dtype=object))
+        res['grid']         = strings['res_grid']
+        res['grid_src']     = strings['res_grid_src']
+        res['count']        = np.where(np.isfinite(count),count,None)
+        res['qrz_checked']  = np.load(os.path.join(path,'res_qrz_checked.npy'),mmap_mode='r')
+        obj.resolved    = res.astype(object)
+        print('Loaded SeqpQTH from {!s}'.format(path))
+        return obj
 
     def print_stats(self):
         df  = self.qth_df
@@ -538,6 +1015,8 @@ class SeqpQTH(object):
             for key,val in self.qth_dict.items():
                     fl_qth.write('{!s}: {!s}\n'.format(key, val))
 
+# The QTH table also depends on the seqp_submissions table.
+@df_cache.cached('seqp_logs',version=2,extra_key=submissions_signature)
 def get_df(log_input,output_dir=None):
     """
     Get the SEQP log entries in a dataframe for scientific processing.
@@ -555,33 +1034,19 @@ def get_df(log_input,output_dir=None):
 
         # Determine best QTH for each call based on submitted, sent, and received
         # information.
-        qth = SeqpQTH(df)
+        qth = SeqpQTH(df=df)
 
     # Apply QTH information to log dataframe and compare with originally logged results.
     df              = df.copy()
     df              = df.rename(columns={'grid_0':'log_grid_0','grid_1':'log_grid_1'})
 
-    df['grid_0']    = None
-    df['grid_1']    = None
-    grid_0          = []
-    grid_src_0      = []
-    grid_1          = []
-    grid_src_1      = []
-
     print('Recomputing locations based on submitted, sent, and received reports...')
-    for inx,row in tqdm.tqdm(df.iterrows(),total=len(df)):
-        qo  = qth.find_qth(row['call_0'])
-        grid_0.append(qo.grid)
-        grid_src_0.append(qo.source)
-
-        qo  = qth.find_qth(row['call_1'])
-        grid_1.append(qo.grid)
-        grid_src_1.append(qo.source)
-    
-    df['grid_0']        = grid_0
-    df['grid_src_0']    = grid_src_0
-    df['grid_1']        = grid_1
-    df['grid_src_1']    = grid_src_1
+    calls   = pd.unique(pd.Series(np.concatenate([df['call_0'].values,df['call_1'].values])).dropna())
+    locs    = qth.resolve_all(calls,qrz_lookup=False)
+    for key in [0,1]:
+        call_k      = 'call_{!s}'.format(key)
+        df['grid_{!s}'.format(key)]     = df[call_k].map(locs['grid'])
+        df['grid_src_{!s}'.format(key)] = df[call_k].map(locs['grid_src'])
 
     # Check to see where the newly assigned grid square does not match
     # the reported one. Print out a table of this.
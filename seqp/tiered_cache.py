@@ -0,0 +1,192 @@
+import os
+import time
+import pickle
+import sqlite3
+from collections import OrderedDict
+
+from . import df_cache
+
+# Default location of the on-disk tier; shares SEQP_CACHE_DIR with df_cache.
+cache_path  = os.path.join(df_cache.cache_dir,'tiered_cache.sqlite')
+
+_missing    = object()
+
+class TieredCache(object):
+    def __init__(self,name,maxsize=100000,path=cache_path,ttl=None,negative_ttl=None):
+        """
+        Key/value cache with two tiers:
+            1. An in-memory LRU of at most maxsize entries.
+            2. An SQLite table (named after the cache) in the file at path,
+               which survives restarts. Use path=None for a RAM-only cache.
+
+        Reads fall through RAM --> disk and promote disk hits into RAM.
+        Writes go to both tiers. Values are pickled on disk, so any
+        picklable value (including None) can be cached.
+
+        Entries stored with negative=True record a failed lookup. They
+        expire after negative_ttl seconds, other entries after ttl
+        seconds (None means never), so that failures can be retried on a
+        different schedule than successes.
+
+        Hit, miss and eviction counters are available from stats().
+        """
+        self.name           = name
+        self.maxsize        = maxsize
+        self.path           = path
+        self.ttl            = ttl
+        self.negative_ttl   = negative_ttl
+        self.table          = 'cache_{!s}'.format(''.join([x if x.isalnum() else '_' for x in name]))
+        self.ram            = OrderedDict()
+        self.counters       = OrderedDict([('ram_hits',0),('disk_hits',0),('negative_hits',0),
+                                           ('misses',0),('expired',0),('evictions',0)])
+        self.__db       = None
+        self.__db_pid   = None
+
+    def __connect(self):
+        """
+        Open the on-disk tier lazily, once per process.
+        """
+        if self.path is None:
+            return None
+
+        if self.__db is None or self.__db_pid != os.getpid():
+            dr  = os.path.dirname(self.path)
+            if dr and not os.path.exists(dr):
+                os.makedirs(dr)
+            db  = sqlite3.connect(self.path,timeout=60)
+            db.execute('PRAGMA journal_mode=WAL;')
+            db.execute('CREATE TABLE IF NOT EXISTS {!s} (key TEXT PRIMARY KEY, value BLOB, stored REAL, negative INTEGER DEFAULT 0);'.format(self.table))
+            cols    = [x[1] for x in db.execute('PRAGMA table_info({!s});'.format(self.table))]
+            if 'negative' not in cols:
+                db.execute('ALTER TABLE {!s} ADD COLUMN negative INTEGER DEFAULT 0;'.format(self.table))
+            db.commit()
+            self.__db       = db
+            self.__db_pid   = os.getpid()
+        return self.__db
+
+    def __expires(self,stored,negative):
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl is None:
+            return None
+        return stored + ttl
+
+    def __ram_set(self,key,value,expires=None,negative=False):
+        self.ram[key] = (value,expires,negative)
+        self.ram.move_to_end(key)
+        while len(self.ram) > self.maxsize:
+            self.ram.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def get_many(self,keys):
+        """
+        Return a dictionary of key --> value for the keys that are cached.
+        Disk misses from RAM are fetched in batched queries.
+        """
+        now     = time.time()
+        result  = {}
+        misses  = []
+        for key in keys:
+            entry   = self.ram.get(key,_missing)
+            if entry is not _missing and entry[1] is not None and entry[1] <= now:
+                del self.ram[key]
+                self.counters['expired'] += 1
+                entry   = _missing
+
+            if entry is _missing:
+                misses.append(key)
+            else:
+                self.ram.move_to_end(key)
+                result[key] = entry[0]
+                self.counters['ram_hits'] += 1
+                if entry[2]:
+                    self.counters['negative_hits'] += 1
+
+        disk_hits   = 0
+        db          = self.__connect()
+        if db is not None and len(misses) > 0:
+            for inx in range(0,len(misses),500):
+                chunk   = misses[inx:inx+500]
+                qry     = 'SELECT key,value,stored,negative FROM {!s} WHERE key IN ({!s});'.format(self.table,','.join(['?']*len(chunk)))
+                for key,blob,stored,negative in db.execute(qry,chunk):
+                    negative    = bool(negative)
+                    expires     = self.__expires(stored,negative)
+                    if expires is not None and expires <= now:
+                        self.counters['expired'] += 1
+                        continue
+
+                    value       = pickle.loads(blob)
+                    result[key] = value
+                    self.__ram_set(key,value,expires,negative)
+                    disk_hits  += 1
+                    if negative:
+                        self.counters['negative_hits'] += 1
+
+        self.counters['disk_hits']  += disk_hits
+        self.counters['misses']     += len(misses) - disk_hits
+        return result
+
+    def get(self,key,default=None):
+        return self.get_many([key]).get(key,default)
+
+    def __getitem__(self,key):
+        value   = self.get(key,_missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self,key):
+        return self.get(key,_missing) is not _missing
+
+    def set_many(self,items,persist=True,negative=False):
+        """
+        Store key/value pairs (a dictionary or an iterable of pairs)
+        in both tiers with a single commit. With persist=False the
+        pairs only go to the RAM tier. Use negative=True to record failed
+        lookups, which expire after negative_ttl.
+        """
+        if hasattr(items,'items'):
+            items   = items.items()
+        items   = list(items)
+        now     = time.time()
+        expires = self.__expires(now,negative)
+        for key,value in items:
+            self.__ram_set(key,value,expires,negative)
+
+        db  = self.__connect() if persist else None
+        if db is not None and len(items) > 0:
+            qry = 'INSERT OR REPLACE INTO {!s} (key,value,stored,negative) VALUES (?,?,?,?);'.format(self.table)
+            db.executemany(qry,[(key,pickle.dumps(value),now,int(negative)) for key,value in items])
+            db.commit()
+
+    def update(self,items):
+        self.set_many(items)
+
+    def __setitem__(self,key,value):
+        self.set_many([(key,value)])
+
+    def clear(self,disk=True):
+        """Empty the RAM tier, and the disk tier unless disk=False."""
+        self.ram.clear()
+        db  = self.__connect()
+        if disk and db is not None:
+            db.execute('DELETE FROM {!s};'.format(self.table))
+            db.commit()
+
+    def __len__(self):
+        return len(self.ram)
+
+    def stats(self):
+        """
+        Return hit/miss/eviction counters and the current RAM tier size.
+        """
+        stats   = OrderedDict(self.counters)
+        stats['ram_size']   = len(self.ram)
+        stats['maxsize']    = self.maxsize
+        return stats
+
+    def __getstate__(self):
+        # Connections cannot be pickled; each process opens its own.
+        state   = self.__dict__.copy()
+        state['_TieredCache__db']       = None
+        state['_TieredCache__db_pid']   = None
+        return state
@@ -1,8 +1,19 @@
+import os
+import bz2
+import calendar
 import datetime
+import multiprocessing as mp
 from collections import OrderedDict
 import numpy as np
 import pandas as pd
 
+from . import gen_lib
+from . import df_cache
+from . import locator
+
+# Column names of the monthly archives at http://wsprnet.org/drupal/downloads
+wsprnet_names   = ['spot_id','timestamp','reporter','reporter_grid','snr','freq','call_sign','grid','power','drift','distance','azimuth','band','version','code']
+
 def wspr_csv_to_df(csv_file):
     """
     Reads a WSPR CSV generated by trim_wspr_web_csv() into a
@@ -11,31 +22,215 @@ def wspr_csv_to_df(csv_file):
     df = pd.read_csv(csv_file,parse_dates=[1])
     return df
 
+def read_wsprnet_archive(filename,chunksize=1000000):
+    """
+    Iterate over a wsprnet monthly archive in blocks of chunksize rows.
+    The timestamp column is left as raw integer epoch seconds.
+    If chunksize is None, the whole archive is yielded as a single block.
+    """
+    if chunksize is None:
+        yield pd.read_csv(filename,header=None,names=wsprnet_names)
+        return
+
+    for chunk in pd.read_csv(filename,header=None,names=wsprnet_names,chunksize=chunksize):
+        yield chunk
+
 def trim_wspr_web_csv(filename="wsprspots-2017-08.csv.gz",
     sTime=datetime.datetime(2017,8,21,14),
-    eTime=datetime.datetime(2017,8,21,22)):
+    eTime=datetime.datetime(2017,8,21,22),
+    chunksize=1000000):
     """
     Reads in a datafile downloaed from http://wsprnet.org/drupal/downloads, parses the dates,
     trims it to the datetimes specified, and outputs a trimmed, compressed, CSV.
+
+    The archive is streamed in blocks of chunksize rows so that peak memory
+    is set by the chunk size rather than by the size of the month. Rows are
+    filtered on the raw integer epoch column before any datetimes are built,
+    and only the surviving rows are converted. sTime and eTime are UTC.
+    Set chunksize=None to read the whole archive at once.
+
+    Returns the path of the file written.
     """
 
-    names   = ['spot_id','timestamp','reporter','reporter_grid','snr','freq','call_sign','grid','power','drift','distance','azimuth','band','version','code']
+    names   = wsprnet_names
 
-    prsr    = lambda x: datetime.datetime.fromtimestamp(float(x))
-    df      = pd.read_csv(filename,header=None,names=names,parse_dates=[1],date_parser=prsr)
-    df.set_index('spot_id',inplace=True)
+    sEpoch  = calendar.timegm(sTime.timetuple())
+    eEpoch  = calendar.timegm(eTime.timetuple())
 
     sTime_str   = sTime.strftime('%Y%m%d.%H%M')
     eTime_str   = eTime.strftime('%Y%m%d.%H%M')
     file_out    = '{}-{}_wsprspots.csv.bz2'.format(sTime_str,eTime_str)
 
-    tf      = np.logical_and(df.timestamp >= sTime, df.timestamp < eTime)
-    df      = df[tf]
+    nrows   = 0
+    header  = True
+    with bz2.open(file_out,'wt') as fl:
+        for chunk in read_wsprnet_archive(filename,chunksize):
+            epoch   = chunk['timestamp'].values
+            tf      = np.logical_and(epoch >= sEpoch, epoch < eEpoch)
+            if not tf.any():
+                continue
+
+            chunk               = chunk[tf].copy()
+            chunk['timestamp']  = pd.to_datetime(chunk['timestamp'],unit='s')
+            chunk.set_index('spot_id',inplace=True)
+
+            chunk.to_csv(fl,header=header)
+            header  = False
+            nrows  += len(chunk)
+
+        if header:
+            # Nothing in the window; still write the column names so the
+            # output reads back as an empty dataframe.
+            empty   = pd.DataFrame(columns=names).set_index('spot_id')
+            empty.to_csv(fl)
+
+    print('Wrote: {} ({:d} spots)'.format(file_out,nrows))
+    return file_out
+
+def grid_in_bbox(grids,bbox):
+    """
+    Test which grid squares fall inside a lat/lon bounding box.
+        grids:  array-like of Maidenhead grid squares
+        bbox:   (lat_0, lon_0, lat_1, lon_1), lower left and upper right corners
+
+    Each grid is located by the center of its 4-character square, so that
+    mixed-precision reports are treated alike. Invalid grids are never inside.
+    """
+    lat_0, lon_0, lat_1, lon_1 = bbox
+    lat, lon    = locator.square2latlon(grids)
+
+    with np.errstate(invalid='ignore'):
+        tf      = (lat >= lat_0) & (lat <= lat_1) & (lon >= lon_0) & (lon <= lon_1)
+    return tf
+
+def filter_wsprnet_chunk(chunk,time_ranges=None,bands=None,
+        reporter_bbox=None,sender_bbox=None,reporter_calls=None,sender_calls=None):
+    """
+    Apply extraction predicates to a raw wsprnet archive chunk (timestamp
+    still in integer epoch seconds). See extract_wspr_archives() for the
+    meaning of each predicate. Cheap predicates are applied first so that
+    the grid lookups only see rows that survive them.
+    """
+    tf  = np.ones(len(chunk),dtype=bool)
+
+    if time_ranges is not None:
+        epoch   = chunk['timestamp'].values
+        tr_tf   = np.zeros(len(chunk),dtype=bool)
+        for sTime,eTime in time_ranges:
+            sEpoch  = calendar.timegm(sTime.timetuple())
+            eEpoch  = calendar.timegm(eTime.timetuple())
+            tr_tf  |= np.logical_and(epoch >= sEpoch, epoch < eEpoch)
+        tf &= tr_tf
+
+    if bands is not None:
+        tf &= chunk['band'].isin(bands).values
+
+    if reporter_calls is not None:
+        tf &= chunk['reporter'].str.upper().isin(reporter_calls).values
+
+    if sender_calls is not None:
+        tf &= chunk['call_sign'].str.upper().isin(sender_calls).values
+
+    chunk   = chunk[tf]
+
+    if reporter_bbox is not None:
+        chunk   = chunk[grid_in_bbox(chunk['reporter_grid'].values,reporter_bbox)]
+
+    if sender_bbox is not None:
+        chunk   = chunk[grid_in_bbox(chunk['grid'].values,sender_bbox)]
+
+    return chunk
+
+def _extract_wspr_archive(run_dct):
+    """
+    Process pool worker for extract_wspr_archives(). Streams one archive,
+    applies the predicates, and writes one output file per UT day.
+    """
+    filename    = run_dct['filename']
+    predicates  = run_dct['predicates']
+
+    # Partition by archive as well as by day so that workers never share files.
+    stem        = os.path.basename(filename).split('.')[0]
+    output_dir  = os.path.join(run_dct['output_dir'],stem)
+    gen_lib.make_dir(output_dir)
+
+    handles     = OrderedDict()
+    nrows       = 0
+    try:
+        for chunk in read_wsprnet_archive(filename,run_dct['chunksize']):
+            chunk   = filter_wsprnet_chunk(chunk,**predicates)
+            if len(chunk) == 0:
+                continue
+
+            chunk               = chunk.copy()
+            chunk['timestamp']  = pd.to_datetime(chunk['timestamp'],unit='s')
+            chunk.set_index('spot_id',inplace=True)
+
+            days    = chunk['timestamp'].dt.strftime('%Y%m%d')
+            for day,day_df in chunk.groupby(days.values,sort=False):
+                if day not in handles:
+                    path            = os.path.join(output_dir,'wsprspots-{!s}.csv.bz2'.format(day))
+                    handles[day]    = (path,bz2.open(path,'wt'))
+                    day_df.to_csv(handles[day][1])
+                else:
+                    day_df.to_csv(handles[day][1],header=False)
+            nrows  += len(chunk)
+    finally:
+        for path,fl in handles.values():
+            fl.close()
+
+    files   = [path for path,fl in handles.values()]
+    print('{!s}: {:d} spots --> {:d} files'.format(filename,nrows,len(files)))
+    return files
+
+def extract_wspr_archives(filenames,output_dir='wspr_extract',
+        time_ranges=None,bands=None,reporter_bbox=None,sender_bbox=None,
+        reporter_calls=None,sender_calls=None,chunksize=1000000,processes=None):
+    """
+    Extract spots from several wsprnet monthly archives at once.
+
+    Each archive is streamed by its own worker in a process pool. Workers apply
+    the predicates while reading and write their results partitioned by
+    archive and UT day as output_dir/<archive>/wsprspots-YYYYMMDD.csv.bz2.
+    These files can be read with wspr_csv_to_df() or get_df().
+
+    Predicates (None means no restriction):
+        time_ranges:    list of (sTime, eTime) UTC pairs; a spot is kept if it
+                        falls in any of them
+        bands:          list of values of the archive band column
+                        (integer MHz, e.g. 14 for 20 m)
+        reporter_bbox:  (lat_0, lon_0, lat_1, lon_1) box for the reporter grid
+        sender_bbox:    (lat_0, lon_0, lat_1, lon_1) box for the sender grid
+        reporter_calls: set of reporter callsigns
+        sender_calls:   set of sender callsigns
+
+    Returns a dictionary of archive filename --> list of files written.
+    """
+    gen_lib.make_dir(output_dir)
+
+    predicates  = {}
+    predicates['time_ranges']       = time_ranges
+    predicates['bands']             = bands
+    predicates['reporter_bbox']     = reporter_bbox
+    predicates['sender_bbox']       = sender_bbox
+    predicates['reporter_calls']    = None if reporter_calls is None else set(x.upper() for x in reporter_calls)
+    predicates['sender_calls']      = None if sender_calls is None else set(x.upper() for x in sender_calls)
+
+    run_list    = []
+    for filename in filenames:
+        tmp = {}
+        tmp['filename']     = filename
+        tmp['output_dir']   = output_dir
+        tmp['predicates']   = predicates
+        tmp['chunksize']    = chunksize
+        run_list.append(tmp)
 
-    df.to_csv(file_out,compression='bz2')
+    with mp.Pool(processes) as pool:
+        results = pool.map(_extract_wspr_archive,run_list)
 
-    print('Wrote: {}'.format(file_out))
+    return OrderedDict(zip(filenames,results))
 
+@df_cache.cached('wspr',version=1)
 def get_df(csv_file):
     """
     Reads a WSPR CSV generated by trim_wspr_web_csv() into a
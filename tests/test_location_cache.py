@@ -0,0 +1,79 @@
+import datetime
+
+import numpy as np
+
+from seqp.location_cache import SqliteLocationCache
+
+def age_rows(cache,callsign,seconds):
+    """
+    Move the lookup time of every row of callsign seconds into the past.
+    """
+    then    = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+    db      = cache.connect()
+    db.execute('UPDATE location_cache SET lookup_datetime = ? WHERE callsign = ?;',
+               (then.strftime('%Y-%m-%d %H:%M:%S'),callsign))
+    db.commit()
+    db.close()
+
+def test_insert_and_lookup_many():
+    cache   = SqliteLocationCache()
+    cache.insert_many([('W2NAF',40.7,-74.2),('K1ABC',42.,-71.)])
+
+    result  = cache.lookup_many(['W2NAF','K1ABC','N0CALL'])
+    assert result == {'W2NAF':(40.7,-74.2),'K1ABC':(42.,-71.)}
+    assert cache.lookup('W2NAF') == (40.7,-74.2)
+    assert cache.lookup('N0CALL') is None
+    assert cache.lookup_many([]) == {}
+
+def test_lookup_many_chunks():
+    cache   = SqliteLocationCache()
+    cache.chunk_size    = 3
+    rows    = [('CALL{:d}'.format(x),float(x),float(-x)) for x in range(10)]
+    cache.insert_many(rows)
+
+    result  = cache.lookup_many([x[0] for x in rows])
+    assert result == {call:(lat,lon) for call,lat,lon in rows}
+
+def test_negative_ttl():
+    cache   = SqliteLocationCache()
+    cache.insert_many([('N0CALL',np.nan,np.nan)])
+
+    lat,lon = cache.lookup_many(['N0CALL'],negative_ttl=3600.)['N0CALL']
+    assert np.isnan(lat) and np.isnan(lon)
+
+    # Expired failures are misses; without a TTL they never expire.
+    age_rows(cache,'N0CALL',7200)
+    assert cache.lookup_many(['N0CALL'],negative_ttl=3600.) == {}
+    assert 'N0CALL' in cache.lookup_many(['N0CALL'])
+
+def test_location_wins_over_failure():
+    cache   = SqliteLocationCache()
+    cache.insert_many([('W2NAF',None,None)])
+    cache.insert_many([('W2NAF',40.7,-74.2)])
+    assert cache.lookup_many(['W2NAF'],negative_ttl=3600.) == {'W2NAF':(40.7,-74.2)}
+
+def test_intervals_ignored_by_lookup():
+    cache   = SqliteLocationCache()
+    cache.insert_intervals([('W2NAF',35.,-80.,datetime.datetime(2017,8,21),None)])
+    assert cache.lookup_many(['W2NAF']) == {}
+    assert len(cache.history_many(['W2NAF'])) > 0
+
+def test_failures_replaced():
+    cache   = SqliteLocationCache()
+    cache.insert_many([('N0CALL',None,None)])
+    age_rows(cache,'N0CALL',7200)
+    cache.insert_many([('N0CALL',None,None)])
+
+    # The retry replaces the expired failure instead of adding a row.
+    db      = cache.connect()
+    nrows   = db.execute('SELECT COUNT(*) FROM location_cache WHERE callsign = ?;',('N0CALL',)).fetchone()[0]
+    db.close()
+    assert nrows == 1
+    assert 'N0CALL' in cache.lookup_many(['N0CALL'],negative_ttl=3600.)
+
+def test_latest_location():
+    cache   = SqliteLocationCache()
+    cache.insert_many([('W2NAF',35.,-80.)])
+    age_rows(cache,'W2NAF',7200)
+    cache.insert_many([('W2NAF',40.7,-74.2)])
+    assert cache.lookup('W2NAF') == (40.7,-74.2)
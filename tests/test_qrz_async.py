@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from seqp.qrz_async import QrzLookupEngine, FakeQrzServer, QrzNotFound, QrzSessionError
+
+records = {'W2NAF':{'lat':'40.7','lon':'-74.2','grid':'FN20'},
+           'K1ABC':{'lat':'42.0','lon':'-71.0','grid':'FN42'}}
+
+@pytest.fixture
+def server():
+    with FakeQrzServer(records) as srv:
+        yield srv
+
+def engine(server,**kwargs):
+    return QrzLookupEngine(username='test',password='test',url=server.url,**kwargs)
+
+def test_lookup_many(server):
+    result  = engine(server).lookup_many(['W2NAF','K1ABC','N0CALL','W2NAF'])
+    assert set(result.keys()) == {'W2NAF','K1ABC','N0CALL'}
+    assert result['W2NAF']['grid'] == 'FN20'
+    assert result['K1ABC']['lat'] == '42.0'
+    assert result['N0CALL'] is None
+
+def test_callsign(server):
+    eng = engine(server)
+    assert eng.callsign('W2NAF')['lon'] == '-74.2'
+    with pytest.raises(QrzNotFound):
+        eng.callsign('N0CALL')
+
+def test_bad_credentials(server):
+    eng = QrzLookupEngine(username='test',password='wrong',url=server.url)
+    with pytest.raises(QrzSessionError):
+        eng.lookup_many(['W2NAF'])
+
+def test_session_expiry(server):
+    eng = engine(server)
+    eng.lookup_many(['W2NAF'])
+    old_key = eng.session_key
+
+    # The stored key is rejected once; the engine logs in again and retries.
+    server.expire_sessions()
+    result  = eng.lookup_many(['K1ABC'])
+    assert result['K1ABC']['grid'] == 'FN42'
+    assert eng.session_key != old_key
+    assert eng.session_key in server.keys
+
+def test_rate_limit(server):
+    # One login plus 10 lookups at 20 requests/s with no burst allowance.
+    eng     = engine(server,rate=20.,burst=1.)
+    calls   = ['CALL{:d}'.format(x) for x in range(10)]
+    time_0  = time.monotonic()
+    eng.lookup_many(calls)
+    elapsed = time.monotonic() - time_0
+
+    assert server.requests == 11
+    assert elapsed >= 10/20. * 0.9
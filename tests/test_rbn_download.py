@@ -0,0 +1,112 @@
+import io
+import os
+import json
+import zipfile
+import datetime
+import threading
+import http.server
+
+import pytest
+
+from seqp.rbn_download import RbnDownloader
+
+ymd_dt  = datetime.datetime(2017,8,21)
+ymd     = ymd_dt.strftime('%Y%m%d')
+
+def make_zip():
+    txt = ['callsign,de_pfx,de_cont,freq,band,dx,dx_pfx,dx_cont,mode,db,date,speed,tx_mode']
+    for minute in range(0,1440,3):
+        txt.append('K1ABC,K,NA,14025.0,20m,W2NAF,W,NA,CQ,10,2017-08-21 {:02d}:{:02d}:00,20,CW'.format(minute//60,minute%60))
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf,'w') as z:
+        z.writestr(ymd+'.csv','\n'.join(txt))
+    return buf.getvalue()
+
+class ArchiveServer(object):
+    def __init__(self,blob,drop_first=False):
+        """
+        Serve blob at /dl.php?f=YYYYMMDD with Range support. With
+        drop_first, the first full request is cut off halfway.
+        """
+        self.blob       = blob
+        self.drop_first = drop_first
+        self.ranges     = []
+
+        server  = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                rng     = self.headers.get('Range')
+                server.ranges.append(rng)
+                start   = 0 if rng is None else int(rng.split('=')[1].rstrip('-'))
+                body    = server.blob[start:]
+                self.send_response(200 if rng is None else 206)
+                self.send_header('Content-Length',str(len(body)))
+                if rng is not None:
+                    self.send_header('Content-Range','bytes {:d}-{:d}/{:d}'.format(start,len(server.blob)-1,len(server.blob)))
+                self.end_headers()
+                if rng is None and server.drop_first:
+                    server.drop_first   = False
+                    self.wfile.write(body[:len(body)//2])
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+            def log_message(self,*args):
+                pass
+
+        self.httpd  = http.server.ThreadingHTTPServer(('127.0.0.1',0),Handler)
+        self.httpd.daemon_threads = True
+        self.url    = 'http://127.0.0.1:{:d}/dl.php?f={{ymd}}'.format(self.httpd.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever,daemon=True).start()
+        return self
+
+    def __exit__(self,*args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def blob():
+    return make_zip()
+
+def test_download_day(tmp_path,blob):
+    with ArchiveServer(blob) as srv:
+        dl      = RbnDownloader(str(tmp_path),url=srv.url,block_sz=1024)
+        path    = dl.download_day(ymd_dt)
+
+        with open(path,'rb') as fl:
+            assert fl.read() == blob
+        assert dl.is_complete(ymd_dt)
+        with open(os.path.join(str(tmp_path),'rbn_manifest.json')) as fl:
+            assert json.load(fl)[ymd]['size'] == len(blob)
+
+        # A complete day is not fetched again.
+        dl.download_day(ymd_dt)
+        assert srv.ranges == [None]
+
+def test_resume_part(tmp_path,blob):
+    part_path   = os.path.join(str(tmp_path),ymd+'.zip.part')
+    with open(part_path,'wb') as fl:
+        fl.write(blob[:1000])
+
+    with ArchiveServer(blob) as srv:
+        dl      = RbnDownloader(str(tmp_path),url=srv.url,block_sz=1024)
+        path    = dl.download_day(ymd_dt)
+
+    assert srv.ranges == ['bytes=1000-']
+    assert not os.path.exists(part_path)
+    with open(path,'rb') as fl:
+        assert fl.read() == blob
+
+def test_resume_after_dropped_connection(tmp_path,blob):
+    with ArchiveServer(blob,drop_first=True) as srv:
+        dl      = RbnDownloader(str(tmp_path),url=srv.url,block_sz=1024)
+        path    = dl.download_day(ymd_dt)
+
+    # The retry asks only for the bytes that did not arrive.
+    assert len(srv.ranges) == 2
+    assert srv.ranges[0] is None
+    assert srv.ranges[1] == 'bytes={:d}-'.format(len(blob)//2)
+    with open(path,'rb') as fl:
+        assert fl.read() == blob